@@ -0,0 +1,122 @@
+from block import block_status
+import os
+import sqlite3
+from threading import RLock
+from transaction import REWARD
+
+
+PATH = "../data/balances.db"
+
+
+class BalanceIndex:
+    """
+    Keeps the confirmed balance and the pending outgoing amount per public key.
+    It is updated as blocks are verified or removed and as the pool changes, so a balance is a single lookup.
+    """
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self.lock = RLock()
+        self.__connection = None
+
+    def open(self):
+        """
+        Opens the balance database, building a new one from the ledger and pool.
+        This has to happen before blocks or transactions are applied, otherwise a new database would count them twice.
+        """
+        with self.lock:
+            self.__get_connection()
+
+    def get_balance(self, public_key):
+        """ Returns the confirmed balance minus the amount that is pending to be sent """
+        confirmed_balance, pending_outgoing = self.get_entry(public_key)
+        return confirmed_balance - pending_outgoing
+
+    def get_entry(self, public_key):
+        """ Returns the confirmed balance and the pending outgoing amount of a public key """
+        with self.lock:
+            row = self.__get_connection().execute(
+                "SELECT Confirmed, PendingOutgoing FROM Balance WHERE PublicKey = ?", (public_key,)
+            ).fetchone()
+        return row if row else (0.0, 0.0)
+
+    def apply_block(self, block, sign=1):
+        """ Adds (sign 1) or takes back (sign -1) the transactions of a verified block """
+        self.__apply(self.__get_block_changes(block, sign))
+
+    def apply_block_change(self, old_block, new_block):
+        """ Applies the change of a stored block, such as a pending block that has been verified """
+        if old_block is not None and new_block is not None and old_block.status == new_block.status:
+            return
+        self.apply_block(old_block, -1)
+        self.apply_block(new_block)
+
+    def apply_pending(self, transaction, sign=1):
+        """ Adds (sign 1) or takes back (sign -1) a pooled transaction's amount to the pending outgoing amount """
+        self.__apply(self.__get_pending_changes(transaction, sign))
+
+    def rebuild(self):
+        """ Recomputes every balance from the ledger and the transaction pool """
+        from ledger import Ledger
+        from transaction_pool import TransactionPool
+        changes = []
+        for block in Ledger.get_blocks():
+            changes += self.__get_block_changes(block)
+        for transaction in TransactionPool.get_transactions():
+            changes += self.__get_pending_changes(transaction)
+        with self.lock:
+            self.__get_connection().execute("DELETE FROM Balance")
+            self.__apply(changes)
+
+    @staticmethod
+    def __get_block_changes(block, sign=1):
+        """ Returns the (public key, confirmed, pending outgoing) changes a block makes """
+        # Only transactions of verified blocks count towards the confirmed balance
+        if block is None or block.status != block_status.get("VERIFIED"):
+            return []
+        changes = []
+        for transaction in block.data:
+            receiver_public_key, amount = transaction.output
+            changes.append((receiver_public_key, sign * amount, 0.0))
+            if transaction.type != REWARD and transaction.input[0] != receiver_public_key:
+                changes.append((transaction.input[0], -sign * transaction.input[1], 0.0))
+        return changes
+
+    @staticmethod
+    def __get_pending_changes(transaction, sign=1):
+        if transaction is None or transaction.type == REWARD or not transaction.input:
+            return []
+        return [(transaction.input[0], 0.0, sign * transaction.input[1])]
+
+    def __apply(self, changes):
+        with self.lock:
+            connection = self.__get_connection()
+            connection.executemany(
+                """ INSERT INTO Balance (PublicKey, Confirmed, PendingOutgoing)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT (PublicKey) DO UPDATE
+                    SET Confirmed = Confirmed + excluded.Confirmed,
+                        PendingOutgoing = PendingOutgoing + excluded.PendingOutgoing
+                    """, changes)
+            connection.commit()
+
+    def __get_connection(self):
+        """ Returns the connection to the balance database, a new database is built from the ledger and pool """
+        if self.__connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            is_new = not os.path.exists(self.path)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.execute(
+                """ CREATE TABLE IF NOT EXISTS Balance (
+                    PublicKey BLOB PRIMARY KEY,
+                    Confirmed REAL NOT NULL DEFAULT 0,
+                    PendingOutgoing REAL NOT NULL DEFAULT 0
+                )"""
+            )
+            self.__connection.commit()
+            if is_new:
+                self.rebuild()
+        return self.__connection
+
+
+balance_index = BalanceIndex()
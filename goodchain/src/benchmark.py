@@ -0,0 +1,351 @@
+"""
+Micro benchmarks for GoodChain's hot paths.
+Run all of them with `python benchmark.py` or a selection with `python benchmark.py <name> [<name> ...]`.
+The benchmarks work on a temporary data directory, the application's data files are left untouched.
+"""
+import os
+import sys
+import tempfile
+from time import perf_counter
+
+
+def benchmark_block_hashing(amount_of_transactions=10, rounds=200):
+    """ Compares the legacy text based block hashing with the canonical byte encoding """
+    from transaction import Transaction
+    from transaction_block import TransactionBlock
+
+    sender, receiver = _register_benchmark_nodes()
+    block = TransactionBlock(None)
+    for i in range(amount_of_transactions):
+        transaction = Transaction(transaction_fee=0.5)
+        transaction.add_input(sender.public_key, 10.0 + i)
+        transaction.add_output(receiver.public_key, 9.5 + i)
+        transaction.sign(sender.private_key)
+        block.add_transaction(transaction)
+
+    print(f"Block hashing ({amount_of_transactions} transactions per block, {rounds} rounds)")
+    for hash_version, name in ((0, "legacy text encoding"), (1, "canonical encoding")):
+        block.hash_version = hash_version
+        start_time = perf_counter()
+        for _ in range(rounds):
+            block.compute_hash()
+        elapsed_time = perf_counter() - start_time
+        print(f"    {name:<26} {rounds / elapsed_time:>12.1f} hashes/s")
+
+
+def benchmark_nonce_search(payload_size=4096, duration=2.0):
+    """ Compares the hashes per second of the legacy mining loop with the tight loop on each hash backend """
+    from mining import HASH_BACKENDS, search_nonce
+    from time import time
+
+    payload = os.urandom(payload_size)
+    # No hash can meet these difficulties, so every variant searches for the full duration
+    impossible_leading_zero = 31
+    impossible_target = 0
+
+    print(f"Nonce search ({payload_size} byte payload, {duration} seconds per variant)")
+    variants = [("legacy loop", lambda deadline: _legacy_nonce_search(payload, impossible_leading_zero, deadline))]
+    for backend in HASH_BACKENDS:
+        variants.append((
+            f"tight loop ({backend})",
+            lambda deadline, backend=backend: search_nonce(
+                payload, impossible_target, 0, 1, deadline, backend=backend
+            )[2]
+        ))
+    for name, variant in variants:
+        start_time = perf_counter()
+        computed_hashes = variant(time() + duration)
+        elapsed_time = perf_counter() - start_time
+        print(f"    {name:<26} {computed_hashes / elapsed_time:>12.1f} hashes/s")
+
+
+def _legacy_nonce_search(payload, leading_zero, deadline):
+    """ Returns the amount of hashes the original mining loop computes before the deadline """
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import hashes
+    from time import time
+
+    digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
+    digest.update(payload)
+    nonce = 0
+    while True:
+        new_digest = digest.copy()
+        new_digest.update(bytes(str(nonce), 'utf-8'))
+        new_hash = new_digest.finalize()
+        if new_hash[:leading_zero] == bytes('0' * leading_zero, 'utf-8'):
+            break
+        elif time() > deadline:
+            break
+        nonce += 1
+        del new_digest
+    return nonce
+
+
+def benchmark_signature_verification(amount_of_transactions=2000, amount_of_senders=20):
+    """ Compares verification throughput with cold (parsed on every call) and warm (cached) public keys """
+    import signature
+
+    transactions = _create_signed_transactions(amount_of_transactions, amount_of_senders)
+    messages = [transaction._Transaction__gather_transaction_data() for transaction in transactions]
+
+    print(f"Signature verification ({amount_of_transactions} transactions from {amount_of_senders} senders)")
+    for name, clear_key_cache in (("cold key cache", True), ("warm key cache", False)):
+        signature.load_public_key.cache_clear()
+        start_time = perf_counter()
+        for transaction, message in zip(transactions, messages):
+            if clear_key_cache:
+                signature.load_public_key.cache_clear()
+            signature.verify(message, transaction.signature, transaction.input[0])
+        elapsed_time = perf_counter() - start_time
+        print(f"    {name:<26} {amount_of_transactions / elapsed_time:>12.1f} verifications/s")
+
+
+def benchmark_batch_verification(amount_of_transactions=2000, amount_of_senders=20):
+    """ Compares verifying signatures one by one with verifying them as a batch over all cores """
+    import signature
+
+    transactions = _create_signed_transactions(amount_of_transactions, amount_of_senders)
+    requests = [
+        (transaction._Transaction__gather_transaction_data(), transaction.signature, transaction.input[0])
+        for transaction in transactions
+    ]
+
+    print(f"Batch signature verification ({amount_of_transactions} transactions, {os.cpu_count()} cores)")
+    for name, workers in (("one by one", 1), ("batch over all cores", None)):
+        start_time = perf_counter()
+        signature.verify_batch(requests, workers)
+        elapsed_time = perf_counter() - start_time
+        print(f"    {name:<26} {amount_of_transactions / elapsed_time:>12.1f} verifications/s")
+
+
+def benchmark_signature_schemes(rounds=200):
+    """ Compares key generation, signing and verification throughput of each signature scheme """
+    import signature
+
+    message = os.urandom(256)
+    print(f"Signature schemes ({rounds} rounds, RSA key generation {max(1, rounds // 20)} rounds)")
+    for scheme, name in signature.SIGNATURE_SCHEMES.items():
+        # RSA key generation is orders of magnitude slower than the others
+        key_rounds = max(1, rounds // 20) if scheme == signature.RSA else rounds
+        start_time = perf_counter()
+        for _ in range(key_rounds):
+            private_key, public_key = signature.generate_serialized_keys(scheme)
+        key_generation_rate = key_rounds / (perf_counter() - start_time)
+
+        start_time = perf_counter()
+        for _ in range(rounds):
+            signature_value = signature.sign(message, private_key, scheme)
+        signing_rate = rounds / (perf_counter() - start_time)
+
+        start_time = perf_counter()
+        for _ in range(rounds):
+            signature.verify(message, signature_value, public_key, scheme)
+        verification_rate = rounds / (perf_counter() - start_time)
+
+        print(f"    {name}")
+        print(f"    {'  key generation':<26} {key_generation_rate:>12.1f} keys/s")
+        print(f"    {'  signing':<26} {signing_rate:>12.1f} signatures/s")
+        print(f"    {'  verification':<26} {verification_rate:>12.1f} verifications/s")
+        print(f"    {'  public key size':<26} {len(public_key):>12} bytes")
+
+
+def benchmark_ledger_analytics(amount_of_transactions=100_000, transactions_per_block=10, amount_of_accounts=1000):
+    """ Compares computing every account balance with an object loop and with the columnar ledger analytics """
+    from block import block_status
+    from ledger import store
+    from ledger_analytics import ledger_analytics
+    from transaction import Transaction, REWARD
+    from transaction_block import TransactionBlock
+
+    if not ledger_analytics.is_available():
+        print("Ledger analytics (skipped, NumPy is not installed)")
+        return
+
+    # Signatures play no part in the aggregates, the transactions are left unsigned
+    accounts = [f"account {i}".encode() for i in range(amount_of_accounts)]
+    block = None
+    for i in range(amount_of_transactions):
+        if i % transactions_per_block == 0:
+            if block is not None:
+                store.append(block)
+            block = TransactionBlock(None)
+            block.status = block_status.get("VERIFIED")
+            block.block_hash = os.urandom(32).hex()
+            transaction = Transaction(transaction_type=REWARD)
+            transaction.add_output(accounts[i % amount_of_accounts], 50.0)
+        else:
+            transaction = Transaction(transaction_fee=0.5)
+            transaction.add_input(accounts[i % amount_of_accounts], 10.5)
+            transaction.add_output(accounts[(i * 7) % amount_of_accounts], 10.0)
+        block.add_transaction(transaction)
+    store.append(block)
+    blocks = store.get_blocks()
+
+    print(f"Ledger analytics ({amount_of_transactions} transactions, {amount_of_accounts} accounts)")
+    start_time = perf_counter()
+    balances = {}
+    for block in blocks:
+        if block.status != block_status.get("VERIFIED"):
+            continue
+        for transaction in block.data:
+            receiver_public_key, amount = transaction.output
+            balances[receiver_public_key] = balances.get(receiver_public_key, 0.0) + amount
+            if transaction.type != REWARD and transaction.input[0] != receiver_public_key:
+                balances[transaction.input[0]] = balances.get(transaction.input[0], 0.0) - transaction.input[1]
+    object_loop_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    ledger_analytics.refresh()
+    build_time = perf_counter() - start_time
+
+    start_time = perf_counter()
+    ledger_analytics.get_balances()
+    vectorized_time = perf_counter() - start_time
+
+    vectorized_balances = ledger_analytics.get_balance_by_public_key()
+    assert all(abs(balances[public_key] - vectorized_balances[public_key]) < 1e-6 for public_key in balances)
+    print(f"    {'object loop':<26} {object_loop_time * 1000:>12.1f} ms")
+    print(f"    {'building the columns once':<26} {build_time * 1000:>12.1f} ms")
+    print(f"    {'vectorized':<26} {vectorized_time * 1000:>12.1f} ms")
+
+
+def benchmark_database_contention(amount_of_nodes=50, amount_of_threads=8, operations_per_thread=500):
+    """ Compares concurrent logins and node server updates on one shared connection and on per-thread connections """
+    import sqlite3
+    from database import Database
+    from threading import Lock, Thread
+    from types import SimpleNamespace
+
+    database = Database()
+    usernames = [f"contention_node_{i}" for i in range(amount_of_nodes)]
+    for username in usernames:
+        database.insert_node(SimpleNamespace(
+            username=username, password_hash="", public_key=f"public key {username}", private_key=""
+        ))
+
+    # One connection shared by all threads that commits after every query, as the database used to work.
+    # Sharing its cursor without a lock can crash the interpreter, so the baseline serializes the queries.
+    shared_connection = sqlite3.connect("../data/database_shared.db", check_same_thread=False)
+    database.connection.backup(shared_connection)
+    shared_connection.execute("PRAGMA journal_mode = DELETE")
+    shared_cursor = shared_connection.cursor()
+    shared_lock = Lock()
+
+    def shared_login(username):
+        with shared_lock:
+            shared_cursor.execute("SELECT * FROM Node WHERE Username = ?", (username,))
+            shared_cursor.fetchone()
+            shared_connection.commit()
+        with shared_lock:
+            shared_cursor.execute("SELECT IsLoggedIn FROM Node WHERE Username = ?", (username,))
+            shared_cursor.fetchone()
+            shared_connection.commit()
+
+    def shared_update(username):
+        with shared_lock:
+            shared_cursor.execute(
+                "UPDATE Node SET LastLogin = CURRENT_TIMESTAMP, IsLoggedIn = 1 WHERE Username = ?", (username,)
+            )
+            shared_connection.commit()
+
+    def login(username):
+        Database().get_node_by_username(username)
+        Database().is_node_logged_in(username)
+
+    def update(username):
+        Database().update_last_login(username, True)
+
+    print(f"Database contention ({amount_of_threads} threads, {operations_per_thread} operations each, "
+          f"a quarter of them updates)")
+    for name, login_operation, update_operation in (
+            ("shared connection", shared_login, shared_update),
+            ("per-thread connections", login, update)):
+        errors = []
+
+        def work(thread_number):
+            for i in range(operations_per_thread):
+                username = usernames[(thread_number * operations_per_thread + i) % amount_of_nodes]
+                try:
+                    if i % 4 == 0:
+                        update_operation(username)
+                    else:
+                        login_operation(username)
+                except sqlite3.Error as error:
+                    errors.append(error)
+
+        threads = [Thread(target=work, args=(thread_number,)) for thread_number in range(amount_of_threads)]
+        start_time = perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed_time = perf_counter() - start_time
+        amount_of_operations = amount_of_threads * operations_per_thread
+        print(f"    {name:<26} {amount_of_operations / elapsed_time:>12.1f} operations/s, {len(errors)} errors")
+    shared_connection.close()
+
+
+def _create_signed_transactions(amount_of_transactions, amount_of_senders):
+    """ Returns signed transactions spread over freshly generated sender keys """
+    from transaction import Transaction
+
+    senders = [_generate_serialized_keys() for _ in range(amount_of_senders)]
+    receiver_public_key = senders[0][1]
+    transactions = []
+    for i in range(amount_of_transactions):
+        private_key, public_key = senders[i % amount_of_senders]
+        transaction = Transaction(transaction_fee=0.5)
+        transaction.add_input(public_key, 10.0)
+        transaction.add_output(receiver_public_key, 9.5)
+        transaction.sign(private_key)
+        transactions.append(transaction)
+    return transactions
+
+
+def _register_benchmark_nodes():
+    """ Returns a sender and receiver node that are registered in the benchmark database """
+    from database import Database
+    from types import SimpleNamespace
+
+    nodes = []
+    database = Database()
+    for username in ("benchmark_sender", "benchmark_receiver"):
+        private_key, public_key = _generate_serialized_keys()
+        node = SimpleNamespace(username=username, password_hash="", public_key=public_key, private_key=private_key)
+        database.insert_node(node)
+        nodes.append(node)
+    return nodes
+
+
+def _generate_serialized_keys():
+    """ Returns a serialized private- and public key pair like the ones nodes get on sign up """
+    import signature
+    return signature.generate_serialized_keys()
+
+
+BENCHMARKS = {
+    "hashing": benchmark_block_hashing,
+    "nonce_search": benchmark_nonce_search,
+    "verification": benchmark_signature_verification,
+    "batch_verification": benchmark_batch_verification,
+    "schemes": benchmark_signature_schemes,
+    "analytics": benchmark_ledger_analytics,
+    "database": benchmark_database_contention
+}
+
+
+def _use_temporary_data_directory():
+    """ Points every data file to a temporary directory so benchmarks never touch real data """
+    data_directory = tempfile.mkdtemp(prefix="goodchain_benchmark_")
+    working_directory = os.path.join(data_directory, "src")
+    os.makedirs(working_directory)
+    os.chdir(working_directory)
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    _use_temporary_data_directory()
+    chosen_benchmarks = sys.argv[1:] or list(BENCHMARKS)
+    for chosen_benchmark in chosen_benchmarks:
+        BENCHMARKS[chosen_benchmark]()
+        print()
@@ -1,6 +1,8 @@
+from canonical import BLOCK_ENCODING_VERSION, encode_block, encode_nonce
 from cryptography.hazmat.backends import default_backend
 from cryptography.hazmat.primitives import hashes
 from datetime import datetime
+from difficulty import get_difficulty_bits, meets_target
 from user_interface import UserInterface, WHITESPACE, TEXT_COLOR
 
 
@@ -11,18 +13,27 @@ block_status = {
 }
 
 
+class BlockMiner:
+    """ Represents the miner of a block by the node details a block needs """
+    def __init__(self, username, public_key):
+        self.username = username
+        self.public_key = public_key
+
+
 class Block:
     data = None
     previous_block_hash = None
     creation_date = None
-    miner = None
     validated_by = ""
+    hash_version = 0  # Blocks created before the canonical encoding are hashed over their text form
+    target = None  # Blocks created before difficulty targets carry none
 
     def __init__(self, data, previous_block):
         self.id = self.__get_unique_id()
+        self.hash_version = BLOCK_ENCODING_VERSION
         self.data = data
         self.block_hash = None
-        self.previous_block = previous_block
+        self.__previous_block = previous_block
         self.nonce = 0
         if previous_block:
             self.previous_block_hash = previous_block.compute_hash()
@@ -31,28 +42,69 @@ class Block:
         self.invalid_flags = 0
         self.creation_date = datetime.now()
         self.status = block_status["UNVERIFIED"]
+        self.miner = None
+
+    @property
+    def previous_block(self):
+        """ Returns the parent block, it is resolved from the ledger when it is not kept in memory """
+        if self.__previous_block is None and self.previous_block_hash is not None:
+            from ledger import Ledger
+            self.__previous_block = Ledger.get_block_by_hash(self.previous_block_hash, self.id - 1)
+        return self.__previous_block
+
+    @property
+    def miner(self):
+        return self.__miner
+
+    @miner.setter
+    def miner(self, miner):
+        # Keep only what a block needs of its miner, not the entire node
+        if miner is not None and not isinstance(miner, BlockMiner):
+            miner = BlockMiner(miner.username, miner.public_key)
+        self.__miner = miner
+
+    def __getstate__(self):
+        """ Returns the compact state of the block which links to its parent by hash only """
+        state = self.__dict__.copy()
+        state.pop("_Block__previous_block", None)
+        return state
+
+    def __setstate__(self, state):
+        # Blocks stored before the compact representation carry their entire ancestry and miner node
+        state.pop("previous_block", None)
+        legacy_miner = state.pop("miner", None)
+        self.__dict__.update(state)
+        self.__previous_block = None
+        if "_Block__miner" not in state:
+            self.miner = legacy_miner
 
     def compute_hash(self):
         digest = hashes.Hash(hashes.SHA256(), backend=default_backend())
-        digest.update(bytes(str(self.data), 'utf-8'))
-        digest.update(bytes(str(self.previous_block_hash), 'utf-8'))
+        if self.hash_version == 0:
+            digest.update(bytes(str(self.data), 'utf-8'))
+            digest.update(bytes(str(self.previous_block_hash), 'utf-8'))
+        else:
+            digest.update(self.get_hash_payload())
+            digest.update(encode_nonce(self.nonce))
         return digest.finalize()
 
+    def get_hash_payload(self):
+        """ Returns the canonical bytes that are hashed together with the nonce """
+        return encode_block(self)
+
     def is_valid(self):
-        current_block_is_valid = self.block_hash == self.compute_hash()
-        if self.previous_block:
-            previous_block_is_valid = self.previous_block.is_valid()
-            return current_block_is_valid and previous_block_is_valid
-        else:
-            return current_block_is_valid
+        """ Returns whether the block's own hash is intact, use ChainValidator to validate its ancestors """
+        if self.block_hash != self.compute_hash():
+            return False
+        if self.hash_version >= 2:
+            # The hash must prove the work demanded by the target in the block header, ChainValidator checks whether
+            # the chain allows that target at the block's height
+            return self.target is not None and meets_target(self.block_hash, self.target)
+        return True
 
     def __get_unique_id(self):
         from ledger import Ledger
-        current_blocks = Ledger.get_blocks()
-        if current_blocks is not None and len(current_blocks) > 0:
-            return len(current_blocks)
-        else:
-            return 0
+        return Ledger.get_chain_length()
 
     def __repr__(self):
         result = ""
@@ -60,7 +112,7 @@ class Block:
         result += f"Block ID: {str(self.id)}\n"
         result += WHITESPACE + fr"Block hash value: {str(self.block_hash)}" + "\n"
 
-        if self.previous_block:
+        if self.previous_block_hash is not None:
             result += WHITESPACE + fr"Previous block hash value: {str(self.previous_block_hash)}" + "\n"
 
         result += WHITESPACE + "Data:\n"
@@ -72,6 +124,8 @@ class Block:
         result += WHITESPACE + f"Mined by: {self.miner.username}\n"
         result += WHITESPACE + f"Total transaction fee: {str(self.total_transaction_fee)}\n"
         result += WHITESPACE + fr"Nonce: {str(self.nonce)}" + "\n"
+        if self.target is not None:
+            result += WHITESPACE + f"Difficulty: {get_difficulty_bits(self.target)} bits\n"
         result += WHITESPACE + f"Creation date: {str(self.creation_date)}\n"
         result += WHITESPACE + f"Validated by: {str(self.validated_by)}\n"
         result += WHITESPACE + f"Valid flags: {str(self.valid_flags)}\n"
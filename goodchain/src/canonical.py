@@ -0,0 +1,78 @@
+import struct
+
+
+# Versions of the canonical encoding given to new transactions and blocks, version 0 is the legacy text encoding
+TRANSACTION_ENCODING_VERSION = 2  # Version 2 adds the signature scheme to the signed message
+BLOCK_ENCODING_VERSION = 2  # Version 2 adds the height, creation date and difficulty target to the block header
+
+LENGTH = struct.Struct(">I")
+AMOUNT = struct.Struct(">d")
+NONCE = struct.Struct(">Q")
+HEIGHT = struct.Struct(">Q")
+TARGET_SIZE = 32
+ABSENT = b"\x00"
+PRESENT = b"\x01"
+
+
+def encode_transaction_message(transaction):
+    """ Returns the canonical bytes of the transaction fields covered by its signature """
+    header = bytes((transaction.encoding_version, transaction.type))
+    if transaction.encoding_version >= 2:
+        header += bytes((transaction.signature_scheme,))
+    return b"".join((
+        header,
+        transaction.id.bytes,
+        AMOUNT.pack(float(transaction.transaction_fee)),
+        _encode_entry(transaction.input),
+        _encode_entry(transaction.output),
+        _encode_optional_bytes(transaction.extra_required_signature)
+    ))
+
+
+def encode_transaction(transaction):
+    """ Returns the canonical bytes of a transaction including its signature """
+    return encode_transaction_message(transaction) + _encode_optional_bytes(transaction.signature)
+
+
+def encode_block(block):
+    """ Returns the canonical bytes of a block's hashed fields, the nonce is appended separately """
+    encoded_transactions = [_encode_bytes(encode_transaction(transaction)) for transaction in block.data]
+    encoded_header = b""
+    if block.hash_version >= 2:
+        # Retargeting reads the height and creation date, so they have to be covered by the proof of work too
+        encoded_header = b"".join((
+            HEIGHT.pack(block.id),
+            _encode_optional_bytes(None if block.creation_date is None else block.creation_date.isoformat()),
+            _encode_optional_bytes(None if block.target is None else block.target.to_bytes(TARGET_SIZE, "big"))
+        ))
+    return b"".join((
+        bytes((block.hash_version,)),
+        _encode_optional_bytes(block.previous_block_hash),
+        encoded_header,
+        LENGTH.pack(len(encoded_transactions)),
+        *encoded_transactions
+    ))
+
+
+def encode_nonce(nonce: int):
+    return NONCE.pack(nonce)
+
+
+def _encode_bytes(value):
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return LENGTH.pack(len(value)) + value
+
+
+def _encode_optional_bytes(value):
+    if value is None:
+        return ABSENT
+    return PRESENT + _encode_bytes(value)
+
+
+def _encode_entry(entry):
+    """ Encodes an (address, amount) input or output """
+    if entry is None:
+        return ABSENT
+    address, amount = entry
+    return PRESENT + _encode_bytes(address) + AMOUNT.pack(float(amount))
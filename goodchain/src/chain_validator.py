@@ -0,0 +1,102 @@
+from canonical import BLOCK_ENCODING_VERSION
+from difficulty import is_target_allowed
+import os
+import pickle
+from ledger import Ledger
+from transaction import verify_transactions
+
+
+CHECKPOINT_PATH = "../data/validation_checkpoint.dat"
+BATCH_SIZE = 100  # Amount of blocks read from the ledger at once while validating
+
+
+class ChainValidator:
+    """ Validates the chain block by block and remembers up to which height it is known to be valid """
+
+    @staticmethod
+    def is_chain_valid(up_to_height=None, full_rescan=False):
+        """
+        Returns whether every block up to and including the given height (default: the last block) is valid.
+        Only blocks above the checkpoint are validated unless a full rescan is requested.
+        """
+        chain_length = Ledger.get_chain_length()
+        if up_to_height is None or up_to_height >= chain_length:
+            up_to_height = chain_length - 1
+
+        validated_height, tip_hash = -1, None
+        if not full_rescan:
+            validated_height, tip_hash = ChainValidator.__get_checkpoint()
+        if validated_height >= up_to_height:
+            return True
+
+        previous_block = Ledger.get_block(validated_height) if validated_height >= 0 else None
+        height = validated_height + 1
+        while height <= up_to_height:
+            blocks = Ledger.get_blocks(height, min(height + BATCH_SIZE, up_to_height + 1))
+            # Verify the signatures of the whole batch at once, the checks per block are then answered by the cache
+            verify_transactions([transaction for block in blocks for transaction in block.data])
+            for block in blocks:
+                if (block.previous_block_hash != tip_hash or not block.is_valid()
+                        or not ChainValidator.__is_placed_at(block, height, previous_block)):
+                    ChainValidator.__set_checkpoint(height - 1, tip_hash)
+                    return False
+                previous_block = block
+                tip_hash = block.block_hash
+                height += 1
+
+        ChainValidator.__set_checkpoint(up_to_height, tip_hash)
+        return True
+
+    @staticmethod
+    def is_block_valid(block):
+        """ Returns whether the block is valid and extends a valid chain """
+        if not block.is_valid():
+            return False
+        if block.previous_block_hash is None:
+            # Genesis block
+            return ChainValidator.__is_placed_at(block, 0, None)
+        previous_block = block.previous_block
+        if previous_block is None or previous_block.block_hash != block.previous_block_hash:
+            return False
+        # The height follows from the parent, the id in the block is only a claim
+        previous_block_height = Ledger.get_height(previous_block)
+        return (
+            previous_block_height is not None
+            and ChainValidator.__is_placed_at(block, previous_block_height + 1, previous_block)
+            and ChainValidator.is_chain_valid(previous_block_height)
+        )
+
+    @staticmethod
+    def __is_placed_at(block, height, previous_block):
+        """ Returns whether the block may follow the previous block at the given height """
+        if previous_block is not None:
+            # A block cannot fall back to an older encoding to escape the checks of a newer one
+            if block.hash_version < previous_block.hash_version:
+                return False
+            if previous_block.hash_version >= 2 and block.hash_version != BLOCK_ENCODING_VERSION:
+                return False
+        if block.hash_version < 2:
+            # Blocks created before difficulty targets are not held to one
+            return True
+        return block.id == height and is_target_allowed(block.target, height)
+
+    @staticmethod
+    def __get_checkpoint():
+        """ Returns the validated height and its block hash, or (-1, None) if the checkpoint no longer applies """
+        try:
+            with open(CHECKPOINT_PATH, "rb") as checkpoint:
+                validated_height, tip_hash = pickle.load(checkpoint)
+        except (FileNotFoundError, EOFError):
+            # There is no checkpoint yet
+            return -1, None
+        # The checkpoint is void once the validated tip has been replaced or removed
+        validated_block = Ledger.get_block(validated_height)
+        if validated_block is None or validated_block.block_hash != tip_hash:
+            return -1, None
+        return validated_height, tip_hash
+
+    @staticmethod
+    def __set_checkpoint(validated_height, tip_hash):
+        os.makedirs(os.path.dirname(CHECKPOINT_PATH), exist_ok=True)
+        with open(CHECKPOINT_PATH, "wb") as checkpoint:
+            pickle.dump((validated_height, tip_hash), checkpoint)
@@ -1,68 +1,249 @@
+from hashlib import sha256
 import os
 import sqlite3
+from threading import local, Lock
 
 
 PATH = "../data/database.db"
+BUSY_TIMEOUT = 5.0  # Seconds a connection waits for another thread's write to finish
+CURRENT_TIME = "strftime('%Y-%m-%d %H:%M:%f', 'now')"  # Millisecond precision keeps registrations apart
+
+
+class ConnectionManager:
+    """
+    Hands every thread its own connection to the node database, so the node server's handler threads never share one.
+    The database runs in WAL journal mode, reads are then never blocked by a write in another thread.
+    """
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self.__local = local()
+        self.__initialization_lock = Lock()
+        self.is_initialized = False
+
+    def get_connection(self):
+        """ Returns the connection of the calling thread, opening it on first use """
+        connection = getattr(self.__local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT)
+            self.__local.connection = connection
+            self.__local.cursor = connection.cursor()
+        return connection
+
+    def get_cursor(self):
+        """ Returns the cursor of the calling thread's connection """
+        self.get_connection()
+        return self.__local.cursor
+
+    def initialize(self, initialize_database):
+        """ Runs initialize_database once per process, the first time a Database is created """
+        with self.__initialization_lock:
+            if not self.is_initialized:
+                try:
+                    # The journal mode is stored in the database file, it is set once
+                    self.get_connection().execute("PRAGMA journal_mode = WAL")
+                except sqlite3.OperationalError:
+                    # Another process holds the database and is setting the journal mode at the same time
+                    pass
+                initialize_database()
+                self.is_initialized = True
+
+
+connection_manager = ConnectionManager()
+
+# Columns of a node in the order the rest of the application indexes them
+NODE_COLUMNS = "Username, PasswordHash, PublicKey, PrivateKey, LastLogin, IsLoggedIn"
+
+
+def get_fingerprint(public_key):
+    """ Returns the compact digest nodes are looked up by instead of their whole serialized public key """
+    if public_key is None:
+        return None
+    if isinstance(public_key, str):
+        public_key = public_key.encode()
+    return sha256(public_key).digest()
 
 
 class Database:
     """ Perform queries on the node database """
     def __init__(self):
-        os.makedirs(os.path.dirname(PATH), exist_ok=True)
-        self.connection = sqlite3.connect(PATH, check_same_thread=False)
-        self.cursor = self.connection.cursor()
-        self.initialize_database()
+        connection_manager.initialize(self.initialize_database)
+
+    @property
+    def connection(self):
+        return connection_manager.get_connection()
+
+    @property
+    def cursor(self):
+        return connection_manager.get_cursor()
 
     def handle_connection(func):
+        """ Commits the changes of a writing query, or rolls them back if it fails """
         def wrapper(self, *args, **kwargs):
-            # Execute function
-            result = func(self, *args, **kwargs)
-            # Commit changes and close connection
+            try:
+                result = func(self, *args, **kwargs)
+            except Exception:
+                self.connection.rollback()
+                raise
             self.connection.commit()
             return result
         return wrapper
 
     @handle_connection
     def initialize_database(self):
-        # Ensure Node table exists
+        migrations = self.__get_migrations()
+        while True:
+            # The write lock is taken before the version is read, so processes starting at the same time
+            # never apply the same migration twice
+            self.cursor.execute("BEGIN IMMEDIATE")
+            # Ensure Node table exists, as it was created before the schema was versioned
+            self.cursor.execute(
+                """ CREATE TABLE IF NOT EXISTS Node (
+                    Username text,
+                    PasswordHash text,
+                    PublicKey text,
+                    PrivateKey text,
+                    LastLogin DATETIME,
+                    IsLoggedIn BOOLEAN DEFAULT 0
+                )"""
+            )
+            # Bring the schema up to date, each migration runs once and in order
+            schema_version = self.cursor.execute("PRAGMA user_version").fetchone()[0]
+            if schema_version >= len(migrations):
+                self.connection.commit()
+                return
+            migrations[schema_version]()
+            self.cursor.execute(f"PRAGMA user_version = {schema_version + 1}")
+            self.connection.commit()
+
+    def __get_migrations(self):
+        """ Returns the schema migrations, the migration at index i brings the schema to version i + 1 """
+        return [self.__add_keys_and_indexes, self.__add_registry_sync]
+
+    def __add_keys_and_indexes(self):
+        """ Rebuilds the Node table with a primary key, unique usernames and indexed public key fingerprints """
+        self.connection.create_function("FINGERPRINT", 1, get_fingerprint, deterministic=True)
+        self.cursor.execute("DROP TABLE IF EXISTS NodeWithKeys")
         self.cursor.execute(
-            """ CREATE TABLE IF NOT EXISTS Node (
-                Username text,
+            """ CREATE TABLE NodeWithKeys (
+                Id INTEGER PRIMARY KEY,
+                Username text NOT NULL,
                 PasswordHash text,
                 PublicKey text,
+                PublicKeyFingerprint BLOB,
                 PrivateKey text,
                 LastLogin DATETIME,
                 IsLoggedIn BOOLEAN DEFAULT 0
             )"""
         )
+        # Sign in has always used the first node of a username, later duplicates are dropped
+        self.cursor.execute(
+            """ INSERT INTO NodeWithKeys (Username, PasswordHash, PublicKey, PublicKeyFingerprint, PrivateKey, LastLogin,
+                                          IsLoggedIn)
+                SELECT Username, PasswordHash, PublicKey, FINGERPRINT(PublicKey), PrivateKey, LastLogin, IsLoggedIn
+                FROM Node
+                WHERE Username IS NOT NULL AND rowid IN (SELECT MIN(rowid) FROM Node GROUP BY Username)
+                ORDER BY rowid
+                """
+        )
+        self.cursor.execute("DROP TABLE Node")
+        self.cursor.execute("ALTER TABLE NodeWithKeys RENAME TO Node")
+        self.cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS NodeUsername ON Node (Username)")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS NodePublicKeyFingerprint ON Node (PublicKeyFingerprint)")
+
+    def __add_registry_sync(self):
+        """ Adds the creation time nodes are synced by and the watermark up to which this registry is synced """
+        columns = [column[1] for column in self.cursor.execute("PRAGMA table_info(Node)").fetchall()]
+        if "CreatedAt" not in columns:
+            self.cursor.execute("ALTER TABLE Node ADD COLUMN CreatedAt TEXT")
+        # The creation time of existing nodes is unknown, they count as created now
+        self.cursor.execute(f"UPDATE Node SET CreatedAt = {CURRENT_TIME} WHERE CreatedAt IS NULL")
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS NodeCreatedAt ON Node (CreatedAt)")
+        self.cursor.execute("CREATE TABLE IF NOT EXISTS RegistrySync (Watermark TEXT)")
+        if self.cursor.execute("SELECT COUNT(*) FROM RegistrySync").fetchone()[0] == 0:
+            self.cursor.execute("INSERT INTO RegistrySync (Watermark) VALUES (NULL)")
 
     @handle_connection
     def insert_node(self, node):
-        """ Inserts a node into the database """
+        """ Inserts a node into the database, returns whether it was inserted or its username was taken already """
         node_dict = {
             'username': node.username,
             'password_hash': node.password_hash,
             'public_key': node.public_key,
+            'public_key_fingerprint': get_fingerprint(node.public_key),
             'private_key': node.private_key
         }
         self.cursor.execute(
-            """ INSERT INTO Node (Username, PasswordHash, PublicKey, PrivateKey)
-                VALUES (:username, :password_hash, :public_key, :private_key)
+            f""" INSERT INTO Node (Username, PasswordHash, PublicKey, PublicKeyFingerprint, PrivateKey, CreatedAt)
+                VALUES (:username, :password_hash, :public_key, :public_key_fingerprint, :private_key, {CURRENT_TIME})
+                ON CONFLICT (Username) DO NOTHING
                 """, node_dict)
+        return self.cursor.rowcount == 1
 
     @handle_connection
+    def insert_synced_nodes(self, registry_rows):
+        """
+        Inserts the (username, password hash, public key, private key, creation time) rows a peer sent in one
+        transaction, skipping usernames that are taken already, and moves the sync watermark up to the newest row.
+        Returns the amount of inserted nodes.
+        """
+        if not registry_rows:
+            return 0
+        self.cursor.executemany(
+            """ INSERT INTO Node (Username, PasswordHash, PublicKey, PublicKeyFingerprint, PrivateKey, CreatedAt)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (Username) DO NOTHING
+                """, [(username, password_hash, public_key, get_fingerprint(public_key), private_key, created_at)
+                      for username, password_hash, public_key, private_key, created_at in registry_rows])
+        amount_of_inserted_nodes = self.cursor.rowcount
+        self.cursor.execute(
+            """ UPDATE RegistrySync
+                SET Watermark = :watermark
+                WHERE Watermark IS NULL OR Watermark < :watermark
+                """, {'watermark': max(row[-1] for row in registry_rows)}
+        )
+        return amount_of_inserted_nodes
+
+    def get_registry_rows(self, watermark=None):
+        """
+        Returns the (username, password hash, public key, private key, creation time) rows of the nodes created at or
+        after the watermark, all of them without one, oldest first
+        """
+        query = "SELECT Username, PasswordHash, PublicKey, PrivateKey, CreatedAt FROM Node"
+        parameters = {}
+        if watermark is not None:
+            # Nodes created in the same millisecond as the watermark are sent again, the receiver skips them
+            query += " WHERE CreatedAt >= :watermark"
+            parameters['watermark'] = watermark
+        self.cursor.execute(query + " ORDER BY CreatedAt", parameters)
+        return self.cursor.fetchall()
+
+    def get_sync_watermark(self):
+        """ Returns the creation time of the newest node received through a registry sync or None """
+        self.cursor.execute("SELECT Watermark FROM RegistrySync")
+        return self.cursor.fetchone()[0]
+
     def get_node_by_username(self, username: str):
         """ Returns a node by username """
-        self.cursor.execute("SELECT * FROM Node WHERE Username = :username", {'username': username})
+        self.cursor.execute(
+            f"SELECT {NODE_COLUMNS} FROM Node WHERE Username = :username", {'username': username}
+        )
         return self.cursor.fetchone()
 
-    @handle_connection
     def get_node_username_by_public_key(self, public_key: str):
-        """ Returns a node by username """
-        self.cursor.execute("SELECT Username FROM Node WHERE PublicKey = :publicKey", {'publicKey': public_key})
+        """ Returns the username of the node with the given public key """
+        self.cursor.execute(
+            "SELECT Username FROM Node WHERE PublicKeyFingerprint = :fingerprint",
+            {'fingerprint': get_fingerprint(public_key)}
+        )
         return self.cursor.fetchone()[0]
 
-    @handle_connection
+    def get_usernames_by_fingerprint(self):
+        """ Returns the public key fingerprint and username of every node """
+        self.cursor.execute("SELECT PublicKeyFingerprint, Username FROM Node")
+        return self.cursor.fetchall()
+
     def get_last_login_date(self, username: str):
         """ Returns the last time a node logged in """
         node = self.get_node_by_username(username)
@@ -92,7 +273,6 @@ class Database:
             """, {'username': username}
         )
 
-    @handle_connection
     def is_node_logged_in(self, username: str):
         """ Returns whether the node is logged in or not """
         self.cursor.execute(
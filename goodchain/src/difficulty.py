@@ -0,0 +1,88 @@
+import json
+
+
+CONFIG_PATH = "../data/difficulty.json"
+HASH_SIZE = 32  # SHA-256 hashes are compared to the target as 256-bit big-endian numbers
+
+# Every node has to derive the same target for a block, so these cannot be changed in the config file
+CONSENSUS_SETTINGS = {
+    # Seconds the network aims for between the creation of two blocks, nodes do not mine a block sooner than this
+    "block_interval": 180,
+    "retarget_window": 5,  # Amount of recent block intervals the next target is based on
+    "maximum_adjustment": 4,  # Factor the target may move by at most per block
+    "initial_target": 2 ** (256 - 20),  # Target until enough blocks exist to retarget
+    "easiest_target": 2 ** (256 - 8),
+    # One in about 17 million hashes meets it, which a single core finds well within the default mining duration
+    "hardest_target": 2 ** (256 - 24)
+}
+# Defaults of the settings that only concern this node, they can be overridden per key in the config file
+DEFAULT_SETTINGS = {
+    "maximum_mining_duration": 60  # Seconds before a nonce search is given up
+}
+
+
+def get_settings():
+    """ Returns the difficulty settings, with the values of the config file taking precedence over the defaults """
+    settings = dict(DEFAULT_SETTINGS)
+    try:
+        with open(CONFIG_PATH, "r") as config:
+            settings.update(json.load(config))
+    except FileNotFoundError:
+        # There is no config file, the defaults apply
+        pass
+    except ValueError:
+        # The config file cannot be parsed, the defaults apply
+        pass
+    # Consensus settings in the config file are ignored
+    settings.update(CONSENSUS_SETTINGS)
+    return settings
+
+
+def get_next_target():
+    """ Returns the target for the block that is mined on top of the current chain """
+    from ledger import Ledger
+    return get_target(Ledger.get_chain_length())
+
+
+def get_target(height: int):
+    """
+    Returns the target for the block at the given height.
+    The target of the previous block is scaled by how far the recent average block interval is off the intended one.
+    """
+    from ledger import Ledger
+    settings = CONSENSUS_SETTINGS
+    window = max(1, int(settings["retarget_window"]))
+    recent_blocks = Ledger.get_blocks(max(0, height - window - 1), height)
+    if len(recent_blocks) < 2:
+        return settings["initial_target"]
+
+    previous_target = recent_blocks[-1].target or settings["initial_target"]
+    elapsed_time = (recent_blocks[-1].creation_date - recent_blocks[0].creation_date).total_seconds()
+    average_interval = elapsed_time / (len(recent_blocks) - 1)
+
+    # Blocks that come too fast lower the target (more work), blocks that come too slow raise it
+    maximum_adjustment = settings["maximum_adjustment"]
+    adjustment = average_interval / settings["block_interval"]
+    adjustment = min(max(adjustment, 1 / maximum_adjustment), maximum_adjustment)
+    next_target = int(previous_target * adjustment)
+    return min(max(next_target, settings["hardest_target"]), settings["easiest_target"])
+
+
+def is_target_allowed(target, height: int):
+    """ Returns whether a block header's target demands at least the work the chain requires at the block's height """
+    return target is not None and 0 < target <= get_target(height)
+
+
+def meets_target(block_hash: bytes, target: int):
+    """ Returns whether a hash, read as a number, does not exceed the target """
+    return block_hash is not None and int.from_bytes(block_hash, "big") <= target
+
+
+def get_target_bytes(target: int):
+    """ Returns the target in the form hashes can be compared to directly """
+    return min(target, 2 ** (HASH_SIZE * 8) - 1).to_bytes(HASH_SIZE, "big")
+
+
+def get_difficulty_bits(target: int):
+    """ Returns the amount of leading zero bits a hash needs at least to meet the target """
+    return HASH_SIZE * 8 - target.bit_length()
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+from threading import RLock
+from transaction import REWARD
+
+
+PATH = "../data/history.db"
+DEFAULT_PAGE_SIZE = 10
+
+
+class HistoryIndex:
+    """
+    Maps every public key to the (block height, position) of the ledger transactions it sent or received.
+    Blocks are indexed as they are appended, so a history is read without walking the whole ledger.
+    """
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self.lock = RLock()
+        self.__connection = None
+
+    def get_history(self, public_key, page_size=DEFAULT_PAGE_SIZE):
+        """ Yields pages of (block height, transaction) pairs the public key took part in, newest first """
+        from ledger import Ledger
+        last_entry = None
+        while True:
+            with self.lock:
+                self.refresh()
+                query = "SELECT Height, Position FROM History WHERE PublicKey = ?"
+                parameters = [public_key]
+                if last_entry is not None:
+                    # Continue below the last entry of the previous page
+                    query += " AND (Height < ? OR (Height = ? AND Position < ?))"
+                    parameters += [last_entry[0], last_entry[0], last_entry[1]]
+                query += " ORDER BY Height DESC, Position DESC LIMIT ?"
+                entries = self.__get_connection().execute(query, parameters + [page_size]).fetchall()
+            if not entries:
+                return
+
+            blocks = {}
+            page = []
+            for height, position in entries:
+                if height not in blocks:
+                    blocks[height] = Ledger.get_block(height)
+                if blocks[height] is not None and position < len(blocks[height].data):
+                    # Blocks removed while paging are left out
+                    page.append((height, blocks[height].data[position]))
+            yield page
+            last_entry = entries[-1]
+
+    def add_block(self, height, block):
+        """ Indexes the transactions of a block appended at the given height """
+        with self.lock:
+            indexed_height, _ = self.__get_checkpoint()
+            if height != indexed_height + 1:
+                # The index is behind the ledger, catch up including this block
+                self.refresh()
+                return
+            self.__index_blocks(height, [block])
+
+    def remove_block(self, height):
+        """ Drops the transactions of the block removed at the given height, the blocks above move down by one """
+        with self.lock:
+            indexed_height, tip_hash = self.__get_checkpoint()
+            if height > indexed_height:
+                return
+            connection = self.__get_connection()
+            connection.execute("DELETE FROM History WHERE Height = ?", (height,))
+            # Rows move through negative heights, so none collides with a row that has not moved down yet
+            connection.execute("UPDATE History SET Height = -Height WHERE Height > ?", (height,))
+            connection.execute("UPDATE History SET Height = -Height - 1 WHERE Height < 0")
+            if height == indexed_height:
+                # The new tip is checked against the ledger on the next refresh
+                tip_hash = None
+            self.__set_checkpoint(indexed_height - 1, tip_hash)
+            connection.commit()
+
+    def refresh(self):
+        """ Indexes the blocks appended since the last refresh, the index is rebuilt if the ledger changed below it """
+        from ledger import Ledger
+        with self.lock:
+            indexed_height, tip_hash = self.__get_checkpoint()
+            if indexed_height >= 0:
+                indexed_block = Ledger.get_block(indexed_height)
+                if indexed_block is None or (tip_hash is not None and indexed_block.block_hash != tip_hash):
+                    self.rebuild()
+                    return
+            chain_length = Ledger.get_chain_length()
+            if indexed_height + 1 < chain_length:
+                self.__index_blocks(indexed_height + 1, Ledger.get_blocks(indexed_height + 1, chain_length))
+
+    def rebuild(self):
+        """ Indexes the whole ledger from scratch """
+        from ledger import Ledger
+        with self.lock:
+            connection = self.__get_connection()
+            connection.execute("DELETE FROM History")
+            self.__set_checkpoint(-1, None)
+            self.__index_blocks(0, Ledger.get_blocks())
+
+    def __index_blocks(self, start_height, blocks):
+        if not blocks:
+            return
+        entries = []
+        for height, block in enumerate(blocks, start=start_height):
+            for position, transaction in enumerate(block.data):
+                entries.append((transaction.output[0], height, position))
+                if transaction.type != REWARD and transaction.input:
+                    entries.append((transaction.input[0], height, position))
+        connection = self.__get_connection()
+        # A transaction to oneself is indexed once
+        connection.executemany(
+            "INSERT OR IGNORE INTO History (PublicKey, Height, Position) VALUES (?, ?, ?)", entries
+        )
+        self.__set_checkpoint(start_height + len(blocks) - 1, blocks[-1].block_hash)
+        connection.commit()
+
+    def __get_checkpoint(self):
+        """ Returns the height up to which blocks are indexed and the hash of the block at that height """
+        return self.__get_connection().execute("SELECT IndexedHeight, TipHash FROM Checkpoint").fetchone()
+
+    def __set_checkpoint(self, indexed_height, tip_hash):
+        self.__get_connection().execute(
+            "UPDATE Checkpoint SET IndexedHeight = ?, TipHash = ?", (indexed_height, tip_hash)
+        )
+
+    def __get_connection(self):
+        if self.__connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.execute(
+                """ CREATE TABLE IF NOT EXISTS History (
+                    PublicKey BLOB NOT NULL,
+                    Height INTEGER NOT NULL,
+                    Position INTEGER NOT NULL,
+                    PRIMARY KEY (PublicKey, Height, Position)
+                )"""
+            )
+            self.__connection.execute(
+                "CREATE TABLE IF NOT EXISTS Checkpoint (IndexedHeight INTEGER NOT NULL, TipHash BLOB)"
+            )
+            if self.__connection.execute("SELECT COUNT(*) FROM Checkpoint").fetchone()[0] == 0:
+                self.__connection.execute("INSERT INTO Checkpoint (IndexedHeight, TipHash) VALUES (-1, NULL)")
+            self.__connection.commit()
+        return self.__connection
+
+
+history_index = HistoryIndex()
@@ -0,0 +1,112 @@
+from cryptography.fernet import Fernet, InvalidToken
+from file_lock import file_lock
+import os
+import pickle
+import signature
+from threading import Lock, Thread
+
+
+POOL_PATH = "../data/key_pool.dat"
+SECRET_PATH = "../data/key_pool.key"
+SECRET_ENVIRONMENT_VARIABLE = "GOODCHAIN_KEY_POOL_SECRET"  # Takes precedence over the secret file when set
+DEFAULT_DEPTH = 5  # Amount of ready key pairs the pool is refilled to
+
+
+class KeyPool:
+    """
+    Pool of pre-generated key pairs of one signature scheme, refilled by a background thread.
+    The pool is persisted encrypted, so ready keys survive a restart without ever being stored in plain text.
+    Nodes sharing the data directory share the pool, every change re-reads it under a file lock so no key pair is
+    handed out twice.
+    """
+
+    def __init__(self, scheme=signature.RSA, depth=DEFAULT_DEPTH, path=POOL_PATH, secret_path=SECRET_PATH):
+        self.scheme = scheme
+        self.depth = depth
+        self.path = path
+        self.secret_path = secret_path
+        self.lock_path = path + ".lock"
+        self.lock = Lock()
+        self.__refill_thread = None
+
+    def __len__(self):
+        with file_lock(self.lock_path):
+            return len(self.__load())
+
+    def take(self):
+        """
+        Returns a serialized private- and public key from the pool and refills the pool in the background.
+        A key is generated on the spot when the pool has run dry.
+        """
+        with file_lock(self.lock_path):
+            pooled_keys = self.__load()
+            keys = pooled_keys.pop(0) if pooled_keys else None
+            if keys is not None:
+                self.__save(pooled_keys)
+        self.fill_in_background()
+        return keys or signature.generate_serialized_keys(self.scheme)
+
+    def fill_in_background(self):
+        """ Starts refilling the pool up to its depth, unless a refill is running already """
+        with self.lock:
+            if self.__refill_thread is not None and self.__refill_thread.is_alive():
+                return
+            self.__refill_thread = Thread(target=self.fill, daemon=True)
+            self.__refill_thread.start()
+
+    def fill(self):
+        """ Generates key pairs until the pool has reached its depth """
+        while len(self) < self.depth:
+            # Generating happens outside the lock so keys can be taken meanwhile
+            keys = signature.generate_serialized_keys(self.scheme)
+            with file_lock(self.lock_path):
+                pooled_keys = self.__load()
+                pooled_keys.append(keys)
+                self.__save(pooled_keys)
+
+    def __load(self):
+        """ Returns the persisted pool, a pool that cannot be decrypted is discarded. The file lock must be held. """
+        try:
+            with open(self.path, "rb") as pool_file:
+                return pickle.loads(self.__get_cipher().decrypt(pool_file.read()))
+        except FileNotFoundError:
+            # There is no pool yet
+            return []
+        except InvalidToken:
+            # The pool was tampered with or encrypted under another secret, its keys cannot be trusted
+            return []
+
+    def __save(self, pooled_keys):
+        """ Persists the pool. The file lock must be held. """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary_path = self.path + ".tmp"
+        with open(temporary_path, "wb") as pool_file:
+            pool_file.write(self.__get_cipher().encrypt(pickle.dumps(pooled_keys)))
+        os.replace(temporary_path, self.path)
+
+    def __get_cipher(self):
+        """ Returns the cipher of the pool, its secret is created on first use when not provided """
+        secret = os.environ.get(SECRET_ENVIRONMENT_VARIABLE)
+        if secret:
+            return Fernet(secret.encode())
+        try:
+            with open(self.secret_path, "rb") as secret_file:
+                return Fernet(secret_file.read())
+        except FileNotFoundError:
+            pass
+        secret = Fernet.generate_key()
+        os.makedirs(os.path.dirname(self.secret_path), exist_ok=True)
+        try:
+            # Only the owner of the application may read the secret
+            secret_file_descriptor = os.open(self.secret_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            # Another node created the secret meanwhile, it is written under the same file lock
+            with open(self.secret_path, "rb") as secret_file:
+                return Fernet(secret_file.read())
+        with os.fdopen(secret_file_descriptor, "wb") as secret_file:
+            secret_file.write(secret)
+        return Fernet(secret)
+
+
+# Only RSA keys are slow enough to generate to be worth pooling
+key_pool = KeyPool(signature.RSA)
@@ -1,9 +1,16 @@
+from balance_index import balance_index
+from history_index import history_index, DEFAULT_PAGE_SIZE
+from ledger_analytics import ledger_analytics
+import os
 import pickle
+from ledger_store import LedgerStore
 from transaction_block import TransactionBlock
 from user_interface import UserInterface, WHITESPACE, TEXT_COLOR
 
 
-path = "../data/ledger.dat"
+path = "../data/ledger.dat"  # Legacy single file ledger, imported into the store on startup
+directory = "../data/ledger"
+store = LedgerStore(directory)
 UI = UserInterface()
 NO_BLOCKS_IN_CHAIN = UI.format_text("There are no blocks in our chain yet.", TEXT_COLOR.get("RED"))
 
@@ -20,7 +27,11 @@ class Ledger:
             "2 - View all blocks\n"
             "3 - View all blocks (paged)\n"
             "4 - View last block\n"
-            "5 - Go back\n"
+            "5 - Audit the entire chain\n"
+            "6 - Rebuild the balances from the ledger\n"
+            "7 - View the transaction history of a node\n"
+            "8 - View ledger statistics\n"
+            "9 - Go back\n"
         )
 
     @staticmethod
@@ -43,6 +54,18 @@ class Ledger:
                     UI.clear_console()
                     print(WHITESPACE + UI.format_text(f"{Ledger.get_last_block()}", TEXT_COLOR.get("CYAN")))
                 case 5:
+                    UI.clear_console()
+                    Ledger.audit_chain()
+                case 6:
+                    UI.clear_console()
+                    Ledger.rebuild_balances()
+                case 7:
+                    UI.clear_console()
+                    Ledger.show_transaction_history()
+                case 8:
+                    UI.clear_console()
+                    Ledger.show_statistics()
+                case 9:
                     return
                 case _:
                     raise ValueError(UI.INVALID_MENU_ITEM)
@@ -52,13 +75,13 @@ class Ledger:
     @staticmethod
     def show_block_by_id():
         """ Prints a block by id"""
-        blocks = Ledger.get_blocks()
-        if blocks:
+        chain_length = Ledger.get_chain_length()
+        if chain_length > 0:
             chosen_block_id = input("\nEnter the ID of the block you'd like to validate.\n" + UI.INPUT_ARROW).strip()
             try:
                 chosen_block_id = int(chosen_block_id)
-                if 0 <= chosen_block_id < len(blocks):
-                    chosen_block = blocks[chosen_block_id]
+                if 0 <= chosen_block_id < chain_length:
+                    chosen_block = Ledger.get_block(chosen_block_id)
                     print(WHITESPACE + UI.format_text(f"{chosen_block}", TEXT_COLOR.get("CYAN")))
                 else:
                     print(UI.INVALID_ID)
@@ -69,12 +92,93 @@ class Ledger:
         else:
             print(NO_BLOCKS_IN_CHAIN)
 
+    @staticmethod
+    def audit_chain():
+        """ Validates every block in the chain, ignoring previously validated heights """
+        from chain_validator import ChainValidator
+        if Ledger.get_chain_length() < 1:
+            print(NO_BLOCKS_IN_CHAIN)
+        elif ChainValidator.is_chain_valid(full_rescan=True):
+            print(UI.format_text("Every block in the chain is valid.", TEXT_COLOR.get("GREEN")))
+        else:
+            print(UI.format_text("The chain contains invalid blocks.", TEXT_COLOR.get("RED")))
+
+    @staticmethod
+    def get_transaction_history(public_key, page_size=DEFAULT_PAGE_SIZE):
+        """ Yields pages of (block height, transaction) pairs the public key sent or received, newest first """
+        return history_index.get_history(public_key, page_size)
+
+    @staticmethod
+    def show_transaction_history():
+        """ Prints the transaction history of a node chosen by its username, page by page """
+        from database import Database
+        username = input("\nEnter the username of the node whose transactions you'd like to see.\n" +
+                         UI.INPUT_ARROW).strip()
+        node = Database().get_node_by_username(username)
+        if node is None:
+            print(UI.format_text("No node with this username could be found.", TEXT_COLOR.get("RED")))
+            return
+        Ledger.show_transaction_history_paged(node[2])
+
+    @staticmethod
+    def show_transaction_history_paged(public_key):
+        """ Prints the ledger transactions a public key took part in, newest first, a page at a time """
+        has_transactions = False
+        for page_number, page in enumerate(Ledger.get_transaction_history(public_key), start=1):
+            has_transactions = True
+            print(UI.format_text(f"\nPage {page_number}\n", TEXT_COLOR.get("YELLOW")))
+            for height, transaction in page:
+                direction = "+" if transaction.output[0] == public_key else "-"
+                print(WHITESPACE + f"{direction} Block {height} | {transaction}")
+            print("\n-----------------\n")
+            print("1 - Next page")
+            print("2 - Go back\n")
+            if input(UI.INPUT_ARROW).strip() != "1":
+                return
+        if not has_transactions:
+            print(UI.format_text("There are no processed transactions yet.", TEXT_COLOR.get("RED")))
+        else:
+            print(UI.format_text("There are no more transactions.", TEXT_COLOR.get("YELLOW")))
+
+    @staticmethod
+    def show_statistics(amount_of_accounts=5):
+        """ Prints totals over every ledger transaction and the accounts with the highest balance """
+        from username_cache import username_cache
+        if not ledger_analytics.is_available():
+            print(UI.format_text("Ledger statistics require NumPy to be installed.", TEXT_COLOR.get("RED")))
+            return
+        if Ledger.get_chain_length() < 1:
+            print(NO_BLOCKS_IN_CHAIN)
+            return
+        fees_per_block = ledger_analytics.get_fees_per_block()
+        print(UI.format_text("Ledger statistics\n", TEXT_COLOR.get("YELLOW")))
+        print(WHITESPACE + f"Transactions: {len(ledger_analytics)}")
+        print(WHITESPACE + f"Coins rewarded: {ledger_analytics.get_total_reward_issuance()}")
+        print(WHITESPACE + f"Fees paid: {fees_per_block.sum()}")
+        print(WHITESPACE + f"Highest fees in a block: {fees_per_block.max()}")
+        print(UI.format_text("\nRichest nodes\n", TEXT_COLOR.get("YELLOW")))
+        for public_key, balance in ledger_analytics.get_richest_accounts(amount_of_accounts):
+            username = username_cache.get_username(public_key) or "Unknown node"
+            print(WHITESPACE + f"{username}: {balance}")
+        username_cache_stats = username_cache.get_stats()
+        print(UI.format_text("\nUsername lookups\n", TEXT_COLOR.get("YELLOW")))
+        print(WHITESPACE + f"{username_cache_stats['hits']} cached, {username_cache_stats['misses']} from the database "
+                           f"({username_cache_stats['hit_rate']:.1%} hit rate, {username_cache_stats['size']} nodes)")
+
+    @staticmethod
+    def rebuild_balances():
+        """ Recomputes every account balance from the ledger and the transaction pool """
+        balance_index.rebuild()
+        print(UI.format_text("The balances are rebuilt from the ledger.", TEXT_COLOR.get("GREEN")))
+
     @staticmethod
     def add_block(block: TransactionBlock):
         """ Adds transaction block to the ledger """
         if block:
-            with open(path, "ab") as ledger:
-                pickle.dump(block, ledger)
+            height = store.append(block)
+            balance_index.apply_block(block)
+            history_index.add_block(height, block)
+            ledger_analytics.add_block(height, block)
 
     @staticmethod
     def show_ledger():
@@ -89,22 +193,22 @@ class Ledger:
 
     @staticmethod
     def show_ledger_paged():
-        all_blocks = Ledger.get_blocks()
+        chain_length = Ledger.get_chain_length()
 
-        if all_blocks is None or len(all_blocks) < 1:
+        if chain_length < 1:
             print(NO_BLOCKS_IN_CHAIN)
             return
 
         current_page = 0
         page_size = 2
-        total_pages = -(-len(all_blocks) // page_size)
+        total_pages = -(-chain_length // page_size)
 
         while True:
             print(UI.format_text(f"\nPage {current_page + 1} of {total_pages}\n", TEXT_COLOR.get("YELLOW")))
 
             start_index = current_page * page_size
             end_index = start_index + page_size
-            blocks_on_current_page = all_blocks[start_index:end_index]
+            blocks_on_current_page = Ledger.get_blocks(start_index, end_index)
 
             for block in blocks_on_current_page:
                 print(WHITESPACE + f"{block}")
@@ -127,48 +231,85 @@ class Ledger:
                 print(UI.INVALID_MENU_ITEM)
 
     @staticmethod
-    def get_blocks():
-        """ Returns a list of blocks out of the ledger """
-        blocks = []
-        try:
-            with open(path, "rb") as ledger:
-                while True:
-                    block = pickle.load(ledger)
-                    blocks.append(block)
-        except FileNotFoundError:
-            # There is no ledger yet
-            pass
-        except EOFError:
-            # No more lines to read from file
-            pass
-        return blocks
+    def get_blocks(start=0, stop=None):
+        """ Returns a list of blocks out of the ledger, optionally limited to a range of heights """
+        return store.get_blocks(start, stop)
+
+    @staticmethod
+    def get_block(height: int):
+        """ Returns the block at the given height or None """
+        return store.get_block(height)
+
+    @staticmethod
+    def get_block_by_hash(block_hash, height_hint=None):
+        """ Returns the block with the given hash value or None, the hinted height is looked at first """
+        with store.lock:
+            if height_hint is not None:
+                candidate = store.get_block(height_hint)
+                if candidate is not None and candidate.block_hash == block_hash:
+                    return candidate
+            for height in range(len(store) - 1, -1, -1):
+                candidate = store.get_block(height)
+                if candidate.block_hash == block_hash:
+                    return candidate
+        return None
+
+    @staticmethod
+    def get_height(block: TransactionBlock):
+        """ Returns the height of the stored block with the same id as the passed block or None """
+        with store.lock:
+            # Block ids equal their height unless blocks below them were removed
+            candidate = store.get_block(block.id)
+            if candidate is not None and candidate.id == block.id:
+                return block.id
+            for height in range(min(block.id, len(store)) - 1, -1, -1):
+                if store.get_block(height).id == block.id:
+                    return height
+        return None
+
+    @staticmethod
+    def get_chain_length():
+        """ Returns the amount of blocks in the ledger without reading them """
+        return len(store)
 
     @staticmethod
     def get_last_block():
         """ Returns the last block out of the ledger or None """
-        all_blocks = Ledger.get_blocks()
-        if all_blocks is not None and len(all_blocks) > 0:
-            return all_blocks[-1]
-        else:
-            return None
+        return store.get_last_block()
 
     @staticmethod
     def update_block(updated_block: TransactionBlock):
         """ Updates the ledger with the passed block """
-        blocks = Ledger.get_blocks()
-        for i, block in enumerate(blocks):
-            if block.id == updated_block.id:
-                blocks[i] = updated_block
-                break
-        with open(path, "wb") as ledger:
-            for block in blocks:
-                pickle.dump(block, ledger)
+        with store.lock:
+            height = Ledger.get_height(updated_block)
+            if height is not None:
+                previous_block = store.get_block(height)
+                store.replace(height, updated_block)
+                balance_index.apply_block_change(previous_block, updated_block)
+                ledger_analytics.update_block(height, updated_block)
 
     @staticmethod
     def remove_block(block_to_remove: TransactionBlock):
         """ Removes the passed block from the ledger """
-        blocks = Ledger.get_blocks()
-        blocks = [block for block in blocks if block.id != block_to_remove.id]
-        with open(path, "wb") as ledger:
-            for block in blocks:
-                pickle.dump(block, ledger)
+        with store.lock:
+            height = Ledger.get_height(block_to_remove)
+            if height is not None:
+                removed_block = store.get_block(height)
+                store.remove(height)
+                balance_index.apply_block(removed_block, -1)
+                history_index.remove_block(height)
+                ledger_analytics.remove_block(height)
+
+    @staticmethod
+    def import_legacy_ledger():
+        """ Moves the blocks of a legacy single file ledger into the store """
+        if not os.path.exists(path) or len(store) > 0:
+            return
+        try:
+            with open(path, "rb") as ledger:
+                while True:
+                    store.append(pickle.load(ledger))
+        except EOFError:
+            # No more lines to read from file
+            pass
+        os.replace(path, path + ".migrated")
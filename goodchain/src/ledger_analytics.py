@@ -0,0 +1,196 @@
+from block import block_status
+from threading import RLock
+from transaction import REWARD
+
+try:
+    import numpy as np
+except ImportError:
+    # Analytics are optional, the rest of the application works without NumPy
+    np = None
+
+
+NO_SENDER = -1  # Sender id of reward transactions
+INITIAL_CAPACITY = 1024  # Amount of transaction rows reserved before the columns have to grow
+COLUMN_TYPES = {
+    "sender": "int64",
+    "receiver": "int64",
+    "amount": "float64",  # Amount the receiver gets
+    "sent_amount": "float64",  # Amount taken from the sender, the fee included
+    "fee": "float64",
+    "height": "int64"
+}
+
+
+class LedgerAnalytics:
+    """
+    Columnar copy of the ledger's transactions in NumPy arrays, kept up to date as blocks are added, verified and
+    removed. Aggregates over all transactions are computed with vectorized group-by sums instead of object loops.
+    Public keys are replaced by account ids, the position of the key in accounts.
+    """
+
+    def __init__(self):
+        self.lock = RLock()
+        self.accounts = []
+        self.__account_ids = {}
+        self.__columns = None
+        self.__size = 0
+        self.__is_verified = None  # Whether the block at each height is verified
+        self.__tip_hash = None
+
+    @staticmethod
+    def is_available():
+        return np is not None
+
+    def __len__(self):
+        with self.lock:
+            self.refresh()
+            return self.__size
+
+    def refresh(self):
+        """ Builds the columns on first use and catches up with blocks the columns have missed """
+        from ledger import Ledger
+        with self.lock:
+            if self.__columns is not None:
+                indexed_height = len(self.__is_verified) - 1
+                indexed_block = Ledger.get_block(indexed_height) if indexed_height >= 0 else None
+                if indexed_height >= 0 and (indexed_block is None or indexed_block.block_hash != self.__tip_hash):
+                    # The ledger changed below the columns, start over
+                    self.__columns = None
+            if self.__columns is None:
+                self.__reset()
+            chain_length = Ledger.get_chain_length()
+            if len(self.__is_verified) < chain_length:
+                self.append_blocks(Ledger.get_blocks(len(self.__is_verified), chain_length))
+
+    def append_blocks(self, blocks):
+        """ Adds the transactions of blocks appended on top of the columns """
+        with self.lock:
+            if self.__columns is None:
+                self.__reset()
+            rows = {name: [] for name in COLUMN_TYPES}
+            start_height = len(self.__is_verified)
+            for height, block in enumerate(blocks, start=start_height):
+                for transaction in block.data:
+                    is_reward = transaction.type == REWARD or not transaction.input
+                    rows["sender"].append(NO_SENDER if is_reward else self.__get_account_id(transaction.input[0]))
+                    rows["receiver"].append(self.__get_account_id(transaction.output[0]))
+                    rows["amount"].append(transaction.output[1])
+                    rows["sent_amount"].append(0.0 if is_reward else transaction.input[1])
+                    rows["fee"].append(float(transaction.transaction_fee or 0))
+                    rows["height"].append(height)
+            self.__append_rows(rows)
+            self.__is_verified = np.concatenate((
+                self.__is_verified, np.array([block.status == block_status.get("VERIFIED") for block in blocks], bool)
+            ))
+            if blocks:
+                self.__tip_hash = blocks[-1].block_hash
+
+    def add_block(self, height, block):
+        """ Adds a block appended to the ledger, if the columns are in use """
+        with self.lock:
+            if self.__columns is not None and height == len(self.__is_verified):
+                self.append_blocks([block])
+
+    def update_block(self, height, block):
+        """ Takes over the status of an updated block, if the columns are in use """
+        with self.lock:
+            if self.__columns is not None and height < len(self.__is_verified):
+                self.__is_verified[height] = block.status == block_status.get("VERIFIED")
+
+    def remove_block(self, height):
+        """ Drops the transactions of a removed block, the blocks above move down by one """
+        with self.lock:
+            if self.__columns is None or height >= len(self.__is_verified):
+                return
+            kept_rows = self.__get_column("height") != height
+            kept_size = int(kept_rows.sum())
+            for name in COLUMN_TYPES:
+                self.__columns[name][:kept_size] = self.__get_column(name)[kept_rows]
+            self.__size = kept_size
+            heights = self.__get_column("height")
+            heights[heights > height] -= 1
+            self.__is_verified = np.delete(self.__is_verified, height)
+            if height == len(self.__is_verified):
+                from ledger import Ledger
+                new_tip = Ledger.get_block(height - 1) if height > 0 else None
+                self.__tip_hash = new_tip.block_hash if new_tip is not None else None
+
+    def get_balances(self):
+        """ Returns the balance of every account over the verified blocks, indexed by account id """
+        with self.lock:
+            self.refresh()
+            senders, receivers = self.__get_column("sender"), self.__get_column("receiver")
+            is_verified = self.__is_verified[self.__get_column("height")]
+            incoming = np.bincount(
+                receivers[is_verified], weights=self.__get_column("amount")[is_verified], minlength=len(self.accounts)
+            )
+            # Like the wallet, a transaction to oneself only counts as incoming
+            is_charged = is_verified & (senders != NO_SENDER) & (senders != receivers)
+            outgoing = np.bincount(
+                senders[is_charged], weights=self.__get_column("sent_amount")[is_charged], minlength=len(self.accounts)
+            )
+            return incoming - outgoing
+
+    def get_balance_by_public_key(self):
+        """ Returns a dictionary of every account's public key and balance """
+        balances = self.get_balances()
+        return {public_key: float(balances[account_id]) for account_id, public_key in enumerate(self.accounts)}
+
+    def get_richest_accounts(self, limit=10):
+        """ Returns the public keys and balances of the accounts with the highest balance, richest first """
+        balances = self.get_balances()
+        richest_account_ids = np.argsort(-balances, kind="stable")[:limit]
+        return [(self.accounts[account_id], float(balances[account_id])) for account_id in richest_account_ids]
+
+    def get_fees_per_block(self):
+        """ Returns the total transaction fee of the block at each height """
+        with self.lock:
+            self.refresh()
+            return np.bincount(
+                self.__get_column("height"), weights=self.__get_column("fee"), minlength=len(self.__is_verified)
+            )
+
+    def get_total_reward_issuance(self):
+        """ Returns the amount of coins rewarded by the system in verified blocks """
+        with self.lock:
+            self.refresh()
+            is_verified = self.__is_verified[self.__get_column("height")]
+            is_reward = self.__get_column("sender") == NO_SENDER
+            return float(self.__get_column("amount")[is_verified & is_reward].sum())
+
+    def __reset(self):
+        self.accounts = []
+        self.__account_ids = {}
+        self.__columns = {name: np.empty(INITIAL_CAPACITY, dtype) for name, dtype in COLUMN_TYPES.items()}
+        self.__size = 0
+        self.__is_verified = np.empty(0, bool)
+        self.__tip_hash = None
+
+    def __append_rows(self, rows):
+        amount_of_rows = len(rows["height"])
+        capacity = len(self.__columns["height"])
+        if self.__size + amount_of_rows > capacity:
+            # Grow geometrically so appending a block at a time stays cheap
+            while self.__size + amount_of_rows > capacity:
+                capacity *= 2
+            for name, column in self.__columns.items():
+                grown_column = np.empty(capacity, column.dtype)
+                grown_column[:self.__size] = column[:self.__size]
+                self.__columns[name] = grown_column
+        for name, values in rows.items():
+            self.__columns[name][self.__size:self.__size + amount_of_rows] = values
+        self.__size += amount_of_rows
+
+    def __get_column(self, name):
+        return self.__columns[name][:self.__size]
+
+    def __get_account_id(self, public_key):
+        account_id = self.__account_ids.get(public_key)
+        if account_id is None:
+            account_id = len(self.accounts)
+            self.__account_ids[public_key] = account_id
+            self.accounts.append(public_key)
+        return account_id
+
+
+ledger_analytics = LedgerAnalytics()
@@ -0,0 +1,51 @@
+import os
+import pickle
+import sys
+from ledger import store
+from system import System
+
+
+def compact_ledger_file(file_path):
+    """ Rewrites a single file ledger so each block links to its parent by hash instead of embedding it """
+    blocks = []
+    try:
+        with open(file_path, "rb") as ledger:
+            while True:
+                blocks.append(pickle.load(ledger))
+    except EOFError:
+        # No more lines to read from file
+        pass
+
+    temporary_path = file_path + ".compacting"
+    with open(temporary_path, "wb") as ledger:
+        for block in blocks:
+            pickle.dump(block, ledger)
+    os.replace(temporary_path, file_path)
+    return len(blocks)
+
+
+def migrate(legacy_file_paths):
+    """ Migrates the ledger store and the given legacy ledger files to the compact block representation """
+    system = System()
+    if not system.is_data_integrity_preserved():
+        return
+
+    for file_path in legacy_file_paths:
+        if not os.path.exists(file_path):
+            # Startup imports the live legacy ledger into the store, which is compacted below
+            print(f"Skipped {file_path}, it does not exist (anymore).")
+            continue
+        amount_of_blocks = compact_ledger_file(file_path)
+        print(f"Compacted {amount_of_blocks} block(s) in {file_path}.")
+
+    size_before = sum(os.path.getsize(path) for path in store.get_file_paths())
+    store.compact()
+    size_after = sum(os.path.getsize(path) for path in store.get_file_paths())
+    print(f"Compacted {len(store)} block(s) in the ledger store from {size_before} to {size_after} bytes.")
+
+    # The data files changed on purpose, so they become the trusted state
+    system.seal()
+
+
+if __name__ == "__main__":
+    migrate(sys.argv[1:])
@@ -1,5 +1,7 @@
+from block import block_status
 from ledger import Ledger
 from server import Server, CRUD
+from transaction_pool import TransactionPool
 
 
 class LedgerServer(Server):
@@ -8,6 +10,26 @@ class LedgerServer(Server):
     def __init__(self, port=default_port):
         super().__init__(port)
         self.server_data_file_path = "../data/ledger_servers.dat"
+        self.tip_listeners = []
+
+    def __getstate__(self):
+        # Listeners belong to this process only
+        state = self.__dict__.copy()
+        state["tip_listeners"] = []
+        return state
+
+    def add_tip_listener(self, listener):
+        """ Registers a callable that receives the new last block whenever a peer changes the chain tip """
+        self.tip_listeners.append(listener)
+
+    def remove_tip_listener(self, listener):
+        if listener in self.tip_listeners:
+            self.tip_listeners.remove(listener)
+
+    def notify_tip_listeners(self):
+        last_block = Ledger.get_last_block()
+        for listener in list(self.tip_listeners):
+            listener(last_block)
 
     def handle_client(self, connection):
         data = self.get_client_data(connection)
@@ -17,14 +39,21 @@ class LedgerServer(Server):
             new_block = data[1]
             if new_block.block_hash:
                 Ledger.add_block(new_block)
+                self.notify_tip_listeners()
         elif crud_operation == CRUD.get("UPDATE"):
             # Update ledger
             updated_block = data[1]
             Ledger.update_block(updated_block)
+            if updated_block.status == block_status.get("VERIFIED"):
+                # A verified chain tip can be mined on top of
+                self.notify_tip_listeners()
         elif crud_operation == CRUD.get("DELETE"):
             # Remove block on ledger
             obsolete_block = data[1]
             Ledger.remove_block(obsolete_block)
+            self.notify_tip_listeners()
+            # The returned transactions may have arrived before this DELETE and been dropped as mined, pool them now
+            TransactionPool.ingest_transactions(obsolete_block.data)
         elif crud_operation == CRUD.get("REGISTER"):
             # Add new server to network
             new_server = data[1]
@@ -0,0 +1,222 @@
+from contextlib import contextmanager
+from file_lock import file_lock
+import os
+import pickle
+import shutil
+import struct
+from threading import RLock
+
+
+SEGMENT_SIZE = 1024 * 1024  # A new segment file is started once the active one exceeds this amount of bytes
+INDEX_RECORD = struct.Struct(">IQI")  # (segment number, offset, length) of a block record
+INDEX_FILE_NAME = "index.dat"
+SEGMENT_FILE_NAME = "segment_{:05d}.dat"
+COMPACTION_THRESHOLD = SEGMENT_SIZE  # Bytes of replaced and removed records tolerated before the store is compacted
+
+
+class LedgerStore:
+    """
+    Stores pickled blocks in append-only segment files next to a fixed-width offset index.
+    The n-th index record points to the block at height n, so a block is read without loading the whole chain.
+    Replaced and removed records stay behind in the segments until they outweigh the live ones, then the store is
+    compacted. Every operation holds a lock file next to the store, so processes sharing the data directory never
+    see a compaction halfway.
+    """
+
+    def __init__(self, directory, compaction_threshold=COMPACTION_THRESHOLD):
+        self.directory = directory
+        self.compaction_threshold = compaction_threshold
+        self.index_path = os.path.join(directory, INDEX_FILE_NAME)
+        self.lock_path = directory + ".lock"
+        self.lock = RLock()
+
+    def __len__(self):
+        """ Returns the amount of blocks in the store by looking at the index size only """
+        with self.__locked():
+            return self.__get_length()
+
+    def get_block(self, height: int):
+        """ Returns the block at the given height or None """
+        with self.__locked():
+            return self.__get_block(height)
+
+    def get_last_block(self):
+        """ Returns the block with the greatest height or None """
+        with self.__locked():
+            return self.__get_block(self.__get_length() - 1)
+
+    def get_blocks(self, start=0, stop=None):
+        """ Returns the blocks within the given height range """
+        with self.__locked():
+            return self.__get_blocks(start, stop)
+
+    def append(self, block):
+        """ Appends a block to the store and returns its height """
+        with self.__locked():
+            return self.__append(block)
+
+    def replace(self, height: int, block):
+        """ Replaces the block at the given height, only its index record is rewritten in place """
+        with self.__locked():
+            if not 0 <= height < self.__get_length():
+                raise IndexError(f"There is no block at height {height}.")
+            entry = self.__write_record(block)
+            with open(self.index_path, "r+b") as index:
+                index.seek(height * INDEX_RECORD.size)
+                index.write(INDEX_RECORD.pack(*entry))
+            self.__compact_if_wasteful()
+
+    def remove(self, height: int):
+        """ Removes the block at the given height, blocks above it move one height down """
+        with self.__locked():
+            if not 0 <= height < self.__get_length():
+                raise IndexError(f"There is no block at height {height}.")
+            with open(self.index_path, "r+b") as index:
+                index.seek((height + 1) * INDEX_RECORD.size)
+                following_records = index.read()
+                index.seek(height * INDEX_RECORD.size)
+                index.write(following_records)
+                index.truncate()
+            self.__compact_if_wasteful()
+
+    def compact(self):
+        """ Rewrites every block into fresh segments, dropping replaced records and re-pickling stored blocks """
+        with self.__locked():
+            self.__compact()
+
+    def get_obsolete_bytes(self):
+        """ Returns the amount of segment bytes taken by records that no index record points to anymore """
+        with self.__locked():
+            return self.__get_obsolete_bytes()
+
+    def get_file_paths(self):
+        """ Returns the paths of all files the store consists of in a stable order """
+        with self.__locked():
+            paths = [os.path.join(self.directory, segment) for segment in self.__get_segment_file_names()]
+            if os.path.exists(self.index_path):
+                paths.append(self.index_path)
+            return paths
+
+    @contextmanager
+    def __locked(self):
+        """ Holds the store for this thread and, through the lock file, for other processes sharing the directory """
+        with self.lock, file_lock(self.lock_path):
+            self.__recover()
+            yield
+
+    def __recover(self):
+        """ Puts the store back in place if a compaction was interrupted after the store was moved aside """
+        obsolete_directory = self.directory + ".obsolete"
+        if not os.path.exists(self.directory) and os.path.exists(obsolete_directory):
+            os.replace(obsolete_directory, self.directory)
+
+    def __compact(self):
+        # The compacted copy is written without locks, nothing else knows of its directory
+        compacted_store = LedgerStore(self.directory + ".compacting", self.compaction_threshold)
+        shutil.rmtree(compacted_store.directory, ignore_errors=True)
+        for block in self.__get_blocks(0, None):
+            compacted_store.__append(block)
+        obsolete_directory = self.directory + ".obsolete"
+        # Only a copy left over by a completed compaction is removed, recovery has restored any other
+        shutil.rmtree(obsolete_directory, ignore_errors=True)
+        if os.path.exists(self.directory):
+            os.replace(self.directory, obsolete_directory)
+        if os.path.exists(compacted_store.directory):
+            os.replace(compacted_store.directory, self.directory)
+        shutil.rmtree(obsolete_directory, ignore_errors=True)
+
+    def __get_obsolete_bytes(self):
+        live_bytes = sum(length for _, _, length in self.__read_index())
+        return self.__get_segment_bytes() - live_bytes
+
+    def __get_length(self):
+        try:
+            return os.path.getsize(self.index_path) // INDEX_RECORD.size
+        except FileNotFoundError:
+            # There is no index yet
+            return 0
+
+    def __get_block(self, height):
+        if not 0 <= height < self.__get_length():
+            return None
+        with open(self.index_path, "rb") as index:
+            index.seek(height * INDEX_RECORD.size)
+            segment, offset, length = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))
+        with open(self.__get_segment_path(segment), "rb") as segment_file:
+            return self.__read_record(segment_file, offset, length)
+
+    def __get_blocks(self, start, stop):
+        entries = self.__read_index()[start:stop]
+        blocks = []
+        segment_files = {}
+        try:
+            for segment, offset, length in entries:
+                if segment not in segment_files:
+                    segment_files[segment] = open(self.__get_segment_path(segment), "rb")
+                blocks.append(self.__read_record(segment_files[segment], offset, length))
+        finally:
+            for segment_file in segment_files.values():
+                segment_file.close()
+        return blocks
+
+    def __append(self, block):
+        entry = self.__write_record(block)
+        with open(self.index_path, "ab") as index:
+            index.write(INDEX_RECORD.pack(*entry))
+        return self.__get_length() - 1
+
+    def __compact_if_wasteful(self):
+        """ Compacts the store once obsolete records pass the threshold and outweigh the live records """
+        obsolete_bytes = self.__get_obsolete_bytes()
+        if obsolete_bytes >= self.compaction_threshold and obsolete_bytes * 2 >= self.__get_segment_bytes():
+            self.__compact()
+
+    def __get_segment_bytes(self):
+        return sum(os.path.getsize(os.path.join(self.directory, name)) for name in self.__get_segment_file_names())
+
+    def __read_index(self):
+        """ Returns all index records as (segment number, offset, length) tuples """
+        try:
+            with open(self.index_path, "rb") as index:
+                data = index.read()
+        except FileNotFoundError:
+            # There is no index yet
+            return []
+        usable_length = len(data) - len(data) % INDEX_RECORD.size
+        return list(INDEX_RECORD.iter_unpack(data[:usable_length]))
+
+    def __write_record(self, block):
+        """ Writes a block record to the active segment and returns its index record """
+        os.makedirs(self.directory, exist_ok=True)
+        record = pickle.dumps(block)
+        segment = self.__get_active_segment()
+        with open(self.__get_segment_path(segment), "ab") as segment_file:
+            offset = segment_file.tell()
+            segment_file.write(record)
+        return segment, offset, len(record)
+
+    def __get_active_segment(self):
+        """ Returns the number of the segment new records are appended to """
+        segment_file_names = self.__get_segment_file_names()
+        if not segment_file_names:
+            return 0
+        segment = int(segment_file_names[-1][len("segment_"):-len(".dat")])
+        if os.path.getsize(self.__get_segment_path(segment)) >= SEGMENT_SIZE:
+            segment += 1
+        return segment
+
+    def __get_segment_file_names(self):
+        try:
+            file_names = os.listdir(self.directory)
+        except FileNotFoundError:
+            # There is no store yet
+            return []
+        return sorted(name for name in file_names if name.startswith("segment_") and name.endswith(".dat"))
+
+    def __get_segment_path(self, segment: int):
+        return os.path.join(self.directory, SEGMENT_FILE_NAME.format(segment))
+
+    @staticmethod
+    def __read_record(segment_file, offset, length):
+        segment_file.seek(offset)
+        return pickle.loads(segment_file.read(length))
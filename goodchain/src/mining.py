@@ -0,0 +1,268 @@
+from canonical import NONCE
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import hashes
+from difficulty import get_settings, get_target_bytes
+from hashlib import sha256
+import multiprocessing
+import os
+from queue import Empty
+from threading import Event, Thread
+from time import time
+
+
+CHECK_INTERVAL = 4096  # Amount of hashes between checks of the stop signal and the clock
+WAIT_INTERVAL = 5  # Seconds a waiting job sleeps before it tries to make a template again
+NOT_READY = "NOT_READY"  # Returned instead of a template while the chain tip does not allow a new block yet
+HASH_BACKENDS = ("hashlib", "cryptography")
+DEFAULT_HASH_BACKEND = "hashlib"
+
+# Mining job statuses
+mining_job_status = {
+    "PREPARING": "PREPARING",
+    "WAITING": "WAITING",
+    "RUNNING": "RUNNING",
+    "MINED": "MINED",
+    "FAILED": "FAILED",
+    "CANCELLED": "CANCELLED"
+}
+
+
+class MiningResult:
+    """ Represents the outcome of a nonce search """
+    def __init__(self, nonce, block_hash, hashes, elapsed_time, workers):
+        self.nonce = nonce
+        self.block_hash = block_hash
+        self.hashes = hashes
+        self.elapsed_time = elapsed_time
+        self.workers = workers
+
+    @property
+    def is_found(self):
+        return self.nonce is not None
+
+    @property
+    def hashrate(self):
+        """ Returns the aggregate amount of hashes per second over all workers """
+        if self.elapsed_time <= 0:
+            return 0.0
+        return self.hashes / self.elapsed_time
+
+
+class MiningEngine:
+    """ Searches a block's nonce by splitting the nonce space over a pool of worker processes """
+
+    def __init__(self, workers=None, backend=DEFAULT_HASH_BACKEND):
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.backend = backend
+        # Amount of hashes computed by the running search, readable while it runs
+        self.hash_counter = multiprocessing.Value("Q", 0)
+
+    def mine(self, payload: bytes, target: int, maximum_duration=None, cancel_event=None):
+        """
+        Returns the MiningResult of searching a nonce for which the hash of the payload meets the target.
+        The search ends early without a nonce once the optional cancel event is set.
+        """
+        if maximum_duration is None:
+            maximum_duration = get_settings()["maximum_mining_duration"]
+        start_time = time()
+        deadline = start_time + maximum_duration
+        with self.hash_counter.get_lock():
+            self.hash_counter.value = 0
+
+        if self.workers > 1:
+            try:
+                return self.__mine_in_parallel(payload, target, start_time, deadline, cancel_event)
+            except OSError:
+                # Worker processes cannot be started here, fall back to a single process
+                pass
+
+        nonce, block_hash, hashes = search_nonce(
+            payload, target, 0, 1, deadline, cancel_event, self.backend, self.hash_counter
+        )
+        return MiningResult(nonce, block_hash, hashes, time() - start_time, 1)
+
+    def __mine_in_parallel(self, payload, target, start_time, deadline, cancel_event):
+        stop_event = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(
+                target=_search_nonce_worker,
+                args=(payload, target, start_nonce, self.workers, deadline,
+                      stop_event, results, self.hash_counter, self.backend),
+                daemon=True
+            )
+            for start_nonce in range(self.workers)
+        ]
+        for process in processes:
+            process.start()
+
+        nonce, block_hash = None, None
+        try:
+            # The first worker to find a nonce ends the search for all workers
+            while nonce is None and any(process.is_alive() for process in processes):
+                if cancel_event is not None and cancel_event.is_set():
+                    break
+                try:
+                    nonce, block_hash = results.get(timeout=0.1)
+                except Empty:
+                    pass
+            if nonce is None and not results.empty():
+                nonce, block_hash = results.get()
+        finally:
+            stop_event.set()
+            for process in processes:
+                process.join()
+        return MiningResult(nonce, block_hash, self.hash_counter.value, time() - start_time, self.workers)
+
+
+class MiningJob(Thread):
+    """
+    Mines a block in the background.
+    The search is restarted on a fresh template whenever the chain tip changes, and ends when no template can be made.
+    While the chain tip does not allow a new block yet, such as before it is verified, the job waits and tries again.
+    """
+
+    def __init__(self, create_template, on_mined, workers=None, backend=DEFAULT_HASH_BACKEND):
+        super().__init__(daemon=True)
+        self.create_template = create_template  # Returns a block with its target set, NOT_READY or None
+        self.on_mined = on_mined  # Receives the block once its nonce and hash are set
+        self.engine = MiningEngine(workers, backend)
+        self.status = mining_job_status["PREPARING"]
+        self.block = None
+        self.restarts = 0
+        self.start_time = time()
+        self.finished_hashes = 0
+        self.__cancel_event = Event()
+        self.__is_cancelled = False
+        self.__is_tip_changed = False
+
+    @property
+    def is_active(self):
+        return self.status in (
+            mining_job_status["PREPARING"], mining_job_status["WAITING"], mining_job_status["RUNNING"]
+        )
+
+    @property
+    def hashes(self):
+        """ Returns the amount of hashes computed over all templates so far """
+        if self.status == mining_job_status["RUNNING"]:
+            return self.finished_hashes + self.engine.hash_counter.value
+        return self.finished_hashes
+
+    @property
+    def hashrate(self):
+        elapsed_time = time() - self.start_time
+        if elapsed_time <= 0:
+            return 0.0
+        return self.hashes / elapsed_time
+
+    def run(self):
+        while True:
+            self.__is_tip_changed = False
+            self.__cancel_event.clear()
+            self.status = mining_job_status["PREPARING"]
+            block = None if self.__is_cancelled else self.create_template()
+            if block == NOT_READY:
+                # Try again once the chain tip changes or the wait is over
+                self.status = mining_job_status["WAITING"]
+                self.__cancel_event.wait(WAIT_INTERVAL)
+                continue
+            if block is None:
+                self.status = mining_job_status["CANCELLED"]
+                return
+
+            self.block = block
+            self.status = mining_job_status["RUNNING"]
+            result = self.engine.mine(block.get_hash_payload(), block.target, cancel_event=self.__cancel_event)
+            self.status = mining_job_status["PREPARING"]
+            self.finished_hashes += result.hashes
+
+            if result.is_found:
+                block.nonce = result.nonce
+                block.block_hash = block.compute_hash()
+                self.on_mined(block)
+                self.status = mining_job_status["MINED"]
+                return
+            if self.__is_cancelled:
+                self.status = mining_job_status["CANCELLED"]
+                return
+            if not self.__is_tip_changed:
+                self.status = mining_job_status["FAILED"]
+                return
+            # The template is stale, start over on top of the new chain tip
+            self.restarts += 1
+
+    def notify_tip_changed(self, new_tip=None):
+        """ Makes the job abandon its current template in favour of a fresh one, or try again while it waits """
+        if not self.is_active:
+            return
+        if (self.status == mining_job_status["RUNNING"] and new_tip is not None
+                and new_tip.block_hash == self.block.previous_block_hash):
+            # The template is still on top of the chain tip
+            return
+        self.__is_tip_changed = True
+        self.__cancel_event.set()
+
+    def cancel(self):
+        """ Stops the job without restarting it """
+        self.__is_cancelled = True
+        self.__cancel_event.set()
+
+
+def search_nonce(payload, target, start_nonce, step, deadline, stop_event=None, backend=DEFAULT_HASH_BACKEND,
+                 hash_counter=None):
+    """
+    Searches the nonces start_nonce, start_nonce + step, ... for a hash that does not exceed the target.
+    Returns the found nonce and hash (or None and None) together with the amount of computed hashes.
+    The optional shared hash counter is raised after every batch so progress can be followed from outside.
+    """
+    if backend == "hashlib":
+        midstate = sha256(payload)
+    elif backend == "cryptography":
+        midstate = hashes.Hash(hashes.SHA256(), backend=default_backend())
+        midstate.update(payload)
+    else:
+        raise ValueError(f"Unknown hash backend '{backend}', choose one of {HASH_BACKENDS}.")
+
+    # Everything the loop needs is prepared once, the nonce is packed into the same buffer on each iteration
+    copy_midstate = midstate.copy
+    pack_nonce = NONCE.pack_into
+    nonce_buffer = bytearray(NONCE.size)
+    # Hashes and the target are compared as equally long big-endian byte strings, which orders them numerically
+    target_bytes = get_target_bytes(target)
+    is_cryptography_backend = backend == "cryptography"
+    batch_step = CHECK_INTERVAL * step
+    nonce = start_nonce
+    computed_hashes = 0
+
+    while True:
+        batch_start = nonce
+        for nonce in range(batch_start, batch_start + batch_step, step):
+            digest = copy_midstate()
+            pack_nonce(nonce_buffer, 0, nonce)
+            digest.update(nonce_buffer)
+            new_hash = digest.finalize() if is_cryptography_backend else digest.digest()
+            if new_hash <= target_bytes:
+                batch_hashes = (nonce - batch_start) // step + 1
+                _count_hashes(hash_counter, batch_hashes)
+                return nonce, new_hash, computed_hashes + batch_hashes
+        nonce += step
+        computed_hashes += CHECK_INTERVAL
+        _count_hashes(hash_counter, CHECK_INTERVAL)
+        # The clock and the stop signal are only looked at once per batch
+        if time() > deadline or (stop_event is not None and stop_event.is_set()):
+            return None, None, computed_hashes
+
+
+def _search_nonce_worker(payload, target, start_nonce, step, deadline, stop_event, results, hash_counter, backend):
+    """ Runs a nonce search in a worker process and reports its outcome to the engine """
+    nonce, block_hash, _ = search_nonce(payload, target, start_nonce, step, deadline, stop_event, backend, hash_counter)
+    if nonce is not None:
+        stop_event.set()
+        results.put((nonce, block_hash))
+
+
+def _count_hashes(hash_counter, amount):
+    if hash_counter is not None:
+        with hash_counter.get_lock():
+            hash_counter.value += amount
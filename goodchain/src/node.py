@@ -1,22 +1,29 @@
 from block import block_status
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
+from chain_validator import ChainValidator
 from database import Database
 from datetime import datetime, timedelta
+from difficulty import CONSENSUS_SETTINGS, get_difficulty_bits, get_next_target
+from key_pool import key_pool
 from ledger import Ledger
 from ledger_client import LedgerClient
 from ledger_server import CRUD
+from mining import MiningJob, NOT_READY, mining_job_status
 from node_client import NodeClient
+import os
+from server import REJECTION_REASON
+import signature
 from system import System
-from transaction import Transaction, REWARD
+from transaction import Transaction, REWARD, verify_transactions
 from transaction_block import TransactionBlock
 from transaction_client import TransactionClient
+from transaction_deduplicator import transaction_deduplicator
 from transaction_pool import TransactionPool
 from user_interface import UserInterface, WHITESPACE, TEXT_COLOR
 from wallet import Wallet
 
 
 MINIMUM_TRANSACTIONS = 5
+NEW_BLOCKS_BATCH_SIZE = 10  # Amount of blocks read from the ledger at once while looking for blocks since a login
 VERIFIED_BLOCK_STATUS = block_status.get("VERIFIED")
 
 
@@ -25,16 +32,18 @@ class Node:
     ui = UserInterface()
     database = Database()
 
-    def __init__(self, user, username, password_hash, keys: (bytes, bytes) = None, show_notifications=False):
+    def __init__(self, user, username, password_hash, keys: (bytes, bytes) = None, show_notifications=False,
+                 signature_scheme=signature.DEFAULT_SIGNATURE_SCHEME):
         self.username = username
         self.password_hash = password_hash
         self.is_logged_in = False
+        self.mining_job = None
 
         if keys:
             self.public_key = keys[0]
             self.private_key = keys[1]
         else:
-            self.private_key, self.public_key = self.__generate_serialized_keys()
+            self.private_key, self.public_key = self.__generate_serialized_keys(signature_scheme)
         self.wallet = Wallet(self)
 
         # Map from user
@@ -49,6 +58,12 @@ class Node:
         if show_notifications:
             self.show_notifications()
 
+    def __getstate__(self):
+        # A mining job belongs to the process that runs it
+        state = self.__dict__.copy()
+        state["mining_job"] = None
+        return state
+
     def check_last_block(self):
         """ Checks whether this user must validate the last block """
         last_block = Ledger.get_last_block()
@@ -64,7 +79,7 @@ class Node:
 
     def verify_block(self, block: TransactionBlock):
         """ Verifies the block by node's username """
-        if block.is_valid():
+        if ChainValidator.is_block_valid(block):
             block.valid_flags += 1
         else:
             block.invalid_flags += 1
@@ -75,33 +90,48 @@ class Node:
             reward_transaction = System.grant_reward(block.miner, (miners_reward + block.total_transaction_fee))
             self.transaction_client.broadcast_change(CRUD.get("ADD"), [reward_transaction])
         elif block.invalid_flags == 3:
+            # Peers pool the block's transactions again when they handle the DELETE, whichever message arrives first
+            Ledger.remove_block(block)
+            self.ledger_client.broadcast_change(CRUD.get("DELETE"), block)
             # Return transactions to pool
             for transaction in block.data:
                 TransactionPool.add_transaction(transaction)
                 self.transaction_client.broadcast_change(CRUD.get("ADD"), [transaction])
-            # Remove block from ledger
-            Ledger.remove_block(block)
-            self.ledger_client.broadcast_change(CRUD.get("DELETE"), block)
             return
 
         block.validated_by += " " + self.username
         Ledger.update_block(block)
         self.ledger_client.broadcast_change(CRUD.get("UPDATE"), block)
 
+    def __get_blocks_created_after(self, date):
+        """ Returns the blocks created after the given date, oldest first, the ledger is read back from its tip """
+        if date is None:
+            return Ledger.get_blocks()
+        new_blocks = []
+        stop = Ledger.get_chain_length()
+        while stop > 0:
+            start = max(0, stop - NEW_BLOCKS_BATCH_SIZE)
+            for block in reversed(Ledger.get_blocks(start, stop)):
+                if block.creation_date <= date:
+                    return new_blocks[::-1]
+                new_blocks.append(block)
+            stop = start
+        return new_blocks[::-1]
+
     def show_notifications(self):
         """ Shows notifications """
         self.ui.clear_console()
         print(f"Welcome {self.username}, here are your notifications:\n")
 
         # Show amount of mined blocks
-        current_blocks = Ledger.get_blocks()
-        chain_length = len(current_blocks)
+        chain_length = Ledger.get_chain_length()
         print(f"GoodChain currently has {chain_length} block(s) in the ledger.")
 
         # Show status of pending transactions and handle invalid transactions
-        transaction_pool = TransactionPool.get_transactions()
-        for transaction in transaction_pool:
-            if transaction.type != REWARD and transaction.input[0] == self.public_key:
+        sent_transaction_ids = set()
+        for transaction in TransactionPool.get_transactions_by_sender(self.public_key):
+            if transaction.type != REWARD:
+                sent_transaction_ids.add(transaction.id)
                 if transaction.valid is False:
                     print("\nYour following transaction:")
                     print(WHITESPACE + f"{transaction}")
@@ -112,7 +142,9 @@ class Node:
                     print("\nYour following transaction:")
                     print(WHITESPACE + f"{transaction}")
                     print("is still pending for withdrawal.")
-            elif transaction.output[0] == self.public_key and transaction.valid is True:
+        # Transactions to oneself are shown once, as sent
+        for transaction in TransactionPool.get_transactions_by_receiver(self.public_key):
+            if transaction.id not in sent_transaction_ids and transaction.valid is True:
                 print("\nThe following transaction:")
                 print(WHITESPACE + f"{transaction}")
                 print("is pending for arrival.")
@@ -127,11 +159,9 @@ class Node:
             print(f"\nYour last login was at {last_login_date.date()}.")
 
         print("\nThese are the new blocks added to our chain:")
-        new_blocks = []
-        for block in current_blocks:
-            if last_login_date is None or block.creation_date > last_login_date:
-                new_blocks.append(block)
-                print(WHITESPACE + f"#{block.id}")
+        new_blocks = self.__get_blocks_created_after(last_login_date)
+        for block in new_blocks:
+            print(WHITESPACE + f"#{block.id}")
 
         # Update last login date
         self.is_logged_in = True
@@ -169,6 +199,8 @@ class Node:
     def show_menu(self):
         """ Shows the private menu """
         print(self.ui.format_text("Node Menu", TEXT_COLOR.get("YELLOW")) + "\n")
+        if self.mining_job:
+            print(self.__get_mining_status() + "\n")
         print(
             "1 - Profile\n"
             "2 - Explore the blockchain\n"
@@ -216,6 +248,7 @@ class Node:
                     self.ui.clear_console()
                     print(self.ui.format_text("Transaction pool", TEXT_COLOR.get("YELLOW")) + "\n")
                     TransactionPool.show_transaction_pool()
+                    self.__show_ingestion_stats()
                 case 7:
                     self.ui.clear_console()
                     print(self.ui.format_text("Mine menu", TEXT_COLOR.get("YELLOW")) + "\n")
@@ -227,7 +260,7 @@ class Node:
                 case 9:
                     self.ui.clear_console()
                     print(self.ui.format_text("Transaction history", TEXT_COLOR.get("YELLOW")) + "\n")
-                    print(self.wallet.transactions)
+                    self.wallet.show_transactions()
                 case 10:
                     self.log_out()
                     return None
@@ -245,13 +278,19 @@ class Node:
         print("Private key: ")
         print(fr"{str(self.private_key, encoding='utf-8')}")
 
-    def mine(self):
-        """ Mines a block if that's possible """
+    def mine(self, workers=None):
+        """
+        Starts mining a block in the background if that's possible, with the given amount of worker processes
+        or as chosen by the user. Shows the progress instead while a mining job is running.
+        """
+        if self.mining_job and self.mining_job.is_active:
+            self.__show_mining_progress()
+            return
+
         # Get data
         transaction_pool = TransactionPool.get_transactions()
-        blocks = Ledger.get_blocks()
 
-        is_genesis_block = blocks is None or len(blocks) < 1
+        is_genesis_block = Ledger.get_chain_length() < 1
 
         if not self.__validate_mining_conditions(transaction_pool, is_genesis_block):
             return
@@ -264,69 +303,58 @@ class Node:
 
         chosen_transactions = self.__get_transactions_to_mine(maximum_transactions)
 
+        if workers is None:
+            workers = self.__get_amount_of_mining_workers()
+
         # Get confirmation
         input("\n" + self.ui.PRESS_ENTER_TO_CONTINUE)
 
         valid_transactions = []
         invalid_transactions = []
-        try:
-            for i, transaction in enumerate(chosen_transactions):
-                if transaction.is_valid():
-                    transaction.valid = True
-                    valid_transactions.append(transaction)
-                else:
-                    invalid_transactions.append(transaction)
-
-            if not self.__validate_mining_conditions(valid_transactions, True):
-                return
-
-            if is_genesis_block:
-                new_block = TransactionBlock(None)
+        verdicts = verify_transactions(chosen_transactions)
+        for transaction, is_valid in zip(chosen_transactions, verdicts):
+            if is_valid:
+                transaction.valid = True
+                valid_transactions.append(transaction)
             else:
-                new_block = TransactionBlock(Ledger.get_last_block())
-
-            total_transaction_fee = 0.0
-            for valid_transaction in valid_transactions:
-                total_transaction_fee += valid_transaction.transaction_fee
-                new_block.add_transaction(valid_transaction)
+                invalid_transactions.append(transaction)
 
-            leading_zeros = 2
-            new_block.mine(leading_zeros)
-            new_block.miner = self
-            new_block.total_transaction_fee = total_transaction_fee
+        # Flag invalid transactions
+        if len(invalid_transactions) > 0:
+            invalid_transactions = self.__flag_invalid_transactions(invalid_transactions)
+            self.transaction_client.broadcast_change(CRUD.get("UPDATE"), invalid_transactions)
 
-            if new_block.block_hash:
-                # Add new block to ledger
-                Ledger.add_block(new_block)
-                self.ledger_client.broadcast_change(CRUD.get("ADD"), new_block)
-
-        except Exception as ex:
-            print(self.ui.format_text("Something went wrong, please try again.", TEXT_COLOR.get("RED")))
-
-        finally:
-            # Remove valid transactions
-            TransactionPool.remove_transactions(valid_transactions)
-            self.transaction_client.broadcast_change(CRUD.get("DELETE"), valid_transactions)
+        if not self.__validate_mining_conditions(valid_transactions, True):
+            return
 
-            # Flag invalid transactions
-            if len(invalid_transactions) > 0:
-                invalid_transactions = self.__flag_invalid_transactions(invalid_transactions)
-                self.transaction_client.broadcast_change(CRUD.get("UPDATE"), invalid_transactions)
+        # Mine in the background, a new chain tip received from a peer makes the job start over once the tip allows it
+        if self.mining_job:
+            self.ledger_server.remove_tip_listener(self.mining_job.notify_tip_changed)
+        self.mining_job = MiningJob(
+            lambda: self.__create_block_template(valid_transactions), self.__publish_mined_block, workers
+        )
+        self.ledger_server.add_tip_listener(self.mining_job.notify_tip_changed)
+        self.mining_job.start()
+        print("\n" + self.ui.format_text("Mining has started in the background, "
+                                         "choose 'Mine' again to follow its progress.", TEXT_COLOR.get("GREEN")))
 
-            # Wrap up the mining process
-            print("\n" + self.ui.format_text("Congrats, expect your reward soon!", TEXT_COLOR.get("GREEN")))
+    def cancel_mining(self):
+        """ Stops the running mining job, its transactions stay in the pool """
+        if self.mining_job and self.mining_job.is_active:
+            self.mining_job.cancel()
+            self.mining_job.join()
 
     def validate_block(self):
         """ Validates a block of choice """
-        blocks = Ledger.get_blocks()
+        chain_length = Ledger.get_chain_length()
         Ledger.show_ledger()
 
         chosen_block_id = input("Enter " + self.ui.BACK + " to go back.\n"
                                 "Enter the ID of the block you'd like to validate\n" + self.ui.INPUT_ARROW).strip()
         try:
             chosen_block_id = int(chosen_block_id)
-            if 0 <= chosen_block_id < len(blocks):
-                chosen_block = blocks[chosen_block_id]
+            if 0 <= chosen_block_id < chain_length:
+                chosen_block = Ledger.get_block(chosen_block_id)
 
                 if chosen_block.miner.username == self.username:
                     print(
@@ -386,13 +414,25 @@ class Node:
 
         transaction.sign(self.private_key)
         if transaction.is_valid():
-            TransactionPool.add_transaction(transaction)
-            self.transaction_client.broadcast_change(CRUD.get("ADD"), [transaction])
+            rejection_reason = TransactionPool.add_transaction(transaction)
+            if rejection_reason is not None:
+                print(self.ui.format_text(REJECTION_REASON.get(rejection_reason), TEXT_COLOR.get("RED")))
+                return
+            rejections = self.transaction_client.broadcast_change(CRUD.get("ADD"), [transaction])
             print(self.ui.format_text("Your transfer is successfully initialised!", TEXT_COLOR.get("GREEN")))
+            for rejection_reason in set(rejections.values()):
+                if rejection_reason in ("POOLED", "MINED"):
+                    # The node has the transaction already, which is what the broadcast is for
+                    continue
+                warning_text = f"Not every node accepted your transaction: {REJECTION_REASON.get(rejection_reason)}"
+                print(self.ui.format_text(warning_text, TEXT_COLOR.get("YELLOW")))
         else:
             print(self.ui.format_text("Your transaction is invalid, please try again.", TEXT_COLOR.get("RED")))
 
     def log_out(self):
+        self.cancel_mining()
+        if self.mining_job:
+            self.ledger_server.remove_tip_listener(self.mining_job.notify_tip_changed)
         self.is_logged_in = False
         self.database.log_out_node(self.username)
         self.node_client.broadcast_change(CRUD.get("UPDATE"), self)
@@ -401,13 +441,10 @@ class Node:
     def cancel_pending_transaction(self):
         """ Cancels a pending transaction if possible """
         # Get applicable transactions
-        pending_transactions = []
-        for transaction in TransactionPool.get_transactions(with_reward_transactions=False):
-            sender_public_key = transaction.input[0]
-            receiver_public_key = transaction.output[0]
-            if sender_public_key == self.public_key:
-                pending_transactions.append(transaction)
-            elif receiver_public_key == self.public_key:
+        pending_transactions = TransactionPool.get_transactions_by_sender(self.public_key)
+        sent_transaction_ids = {transaction.id for transaction in pending_transactions}
+        for transaction in TransactionPool.get_transactions_by_receiver(self.public_key):
+            if transaction.type != REWARD and transaction.id not in sent_transaction_ids:
                 pending_transactions.append(transaction)
 
         if len(pending_transactions) < 1:
@@ -439,13 +476,73 @@ class Node:
         self.transaction_client.broadcast_change(CRUD.get("DELETE"), [transaction_to_cancel])
         print(self.ui.format_text("Your transaction is successfully canceled.", TEXT_COLOR.get("GREEN")))
 
-    def __validate_mining_conditions(self, transaction_pool, is_genesis_block):
+    def __create_block_template(self, transactions: list[Transaction]):
+        """
+        Returns a block to mine on top of the current chain tip, NOT_READY while the chain tip does not allow a new
+        block yet, or None if mining is no longer possible
+        """
+        # Transactions that made it into a block in the meantime are left out
+        transactions = [
+            transaction for transaction in transactions if TransactionPool.get_transaction(transaction.id) is not None
+        ]
+        if not self.__validate_mining_conditions(transactions, True, show_errors=False):
+            return None
+
+        # A new chain tip has to be verified and old enough before a block can be mined on top of it
+        is_genesis_block = Ledger.get_chain_length() < 1
+        if not self.__validate_mining_conditions(transactions, is_genesis_block, show_errors=False):
+            return NOT_READY
+
+        new_block = TransactionBlock(Ledger.get_last_block())
+        for transaction in transactions:
+            new_block.add_transaction(transaction)
+        new_block.miner = self
+        new_block.total_transaction_fee = sum(transaction.transaction_fee for transaction in transactions)
+        new_block.target = get_next_target()
+        return new_block
+
+    def __publish_mined_block(self, block: TransactionBlock):
+        """ Adds a freshly mined block to the ledger and takes its transactions out of the pool """
+        Ledger.add_block(block)
+        self.ledger_client.broadcast_change(CRUD.get("ADD"), block)
+        TransactionPool.remove_transactions(block.data)
+        self.transaction_client.broadcast_change(CRUD.get("DELETE"), block.data)
+
+    def __show_mining_progress(self):
+        """ Prints the progress of the mining job and lets the user cancel it """
+        print(self.__get_mining_status())
+        choice = input("\nEnter 'cancel' to stop mining or press enter to continue.\n" + self.ui.INPUT_ARROW)
+        if choice.strip().lower() == "cancel":
+            self.cancel_mining()
+            print(self.ui.format_text("Mining has been cancelled.", TEXT_COLOR.get("GREEN")))
+
+    def __get_mining_status(self):
+        """ Returns a summary of the latest mining job """
+        job = self.mining_job
+        elapsed_time = int((datetime.now() - datetime.fromtimestamp(job.start_time)).total_seconds())
+        result = f"Mining status: {job.status}\n"
+        if job.block:
+            difficulty_bits = get_difficulty_bits(job.block.target)
+            result += WHITESPACE + f"Block: #{job.block.id} at a difficulty of {difficulty_bits} bits\n"
+        result += WHITESPACE + f"Hashes: {job.hashes} ({job.hashrate:.0f} hashes per second)\n"
+        result += WHITESPACE + f"Elapsed time: {elapsed_time} seconds\n"
+        result += WHITESPACE + f"Restarts on a new chain tip: {job.restarts}"
+        if job.status == mining_job_status.get("WAITING"):
+            minutes = CONSENSUS_SETTINGS["block_interval"] // 60
+            waiting_text = f"Waiting until the latest block is verified and {minutes} minutes old, then mining resumes."
+            result += "\n" + self.ui.format_text(waiting_text, TEXT_COLOR.get("YELLOW"))
+        if job.status == mining_job_status.get("MINED"):
+            result += "\n" + self.ui.format_text("Congrats, expect your reward soon!", TEXT_COLOR.get("GREEN"))
+        return result
+
+    def __validate_mining_conditions(self, transaction_pool, is_genesis_block, show_errors=True):
         """ Validates if GoodChain's mining conditions are met """
         # Transaction pool validation
         if 0 < len(transaction_pool) < MINIMUM_TRANSACTIONS:
             error_text = ("There are not enough transactions in the transaction pool, " +
                           f"there must be at least {MINIMUM_TRANSACTIONS} transactions.")
-            print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
+            if show_errors:
+                print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
             return False
 
         # Time interval validation
@@ -454,17 +551,20 @@ class Node:
             last_block_creation_date = last_block.creation_date
             current_time = datetime.now()
             time_difference = current_time - last_block_creation_date
-            required_time_difference_in_minutes = 3
+            # The retargeting aims for the same interval, so mining as soon as allowed does not raise the difficulty
+            required_time_difference_in_minutes = CONSENSUS_SETTINGS["block_interval"] // 60
             if time_difference < timedelta(minutes=required_time_difference_in_minutes):
                 error_text = \
                     f"It has not been {required_time_difference_in_minutes} minutes since the last block's creation."
-                print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
+                if show_errors:
+                    print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
                 return False
             # Last block validation
             verified_block_status = block_status.get("VERIFIED")
             if last_block.status != verified_block_status:
                 error_text = f"You can not mine a new block until the latest is considered valid."
-                print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
+                if show_errors:
+                    print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
                 return False
 
         # All checks passed
@@ -472,6 +572,17 @@ class Node:
 
     def __get_transactions_to_mine(self, maximum_transactions, show_transactions=True):
         """ Returns the transactions the user is allowed to mine """
+        print("How would you like to fill the block?\n"
+              f"1 - Automatically with the {maximum_transactions} best-paying transactions\n"
+              "2 - Choose transactions myself")
+        while True:
+            chosen_mode = input("Mode " + self.ui.INPUT_ARROW).strip()
+            if chosen_mode == "1":
+                return self.__get_transactions_to_mine_by_fee(maximum_transactions)
+            elif chosen_mode == "2":
+                break
+            print(self.ui.format_text("This is not an existing mode, please try again.", TEXT_COLOR.get("RED")))
+
         chosen_transactions = []
         # Get the first 5 transactions by default
         all_transactions = TransactionPool.get_transactions()
@@ -525,6 +636,21 @@ class Node:
                         print(self.ui.INVALID_ID)
         return chosen_transactions
 
+    def __show_ingestion_stats(self):
+        """ Prints how many transactions received from other nodes were accepted or dropped as duplicates """
+        stats = transaction_deduplicator.get_stats()
+        print(f"\nReceived transactions: {stats['accepted']} accepted, "
+              f"{stats['pool_duplicates']} dropped as already pooled, "
+              f"{stats['ledger_duplicates']} dropped as already in the ledger.")
+
+    def __get_transactions_to_mine_by_fee(self, maximum_transactions):
+        """ Returns the best-paying transactions of the pool, without going through the whole pool """
+        chosen_transactions = TransactionPool.get_transactions_by_fee(maximum_transactions)
+        print(f"The following {len(chosen_transactions)} transaction(s) pay the highest fees.")
+        for transaction in chosen_transactions:
+            print(WHITESPACE + f"{transaction}")
+        return chosen_transactions
+
     def __flag_invalid_transactions(self, invalid_transactions: list[Transaction]):
         """ Returns the given transactions flagged as invalid """
         for invalid_transaction in invalid_transactions:
@@ -562,19 +688,27 @@ class Node:
             print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
             return self.__get_transfer_amount()
 
-    def __generate_serialized_keys(self):
+    def __get_amount_of_mining_workers(self):
+        """ Returns the amount of worker processes the user would like to mine with """
+        available_cores = os.cpu_count() or 1
+        print(f"\nEnter the amount of CPU cores to mine with (1-{available_cores}), "
+              f"or press enter to use all of them.")
+        amount = input("Cores " + self.ui.INPUT_ARROW).strip()
+        if not amount:
+            return available_cores
+        try:
+            amount = int(amount)
+            if 0 < amount <= available_cores:
+                return amount
+        except ValueError:
+            pass
+        error_text = f"This is not an acceptable amount of cores, please try again."
+        print(self.ui.format_text(error_text, TEXT_COLOR.get("RED")))
+        return self.__get_amount_of_mining_workers()
+
+    def __generate_serialized_keys(self, signature_scheme=signature.DEFAULT_SIGNATURE_SCHEME):
         """ Returns a serialized cryptographic private- and public key object """
-        # Generate keys
-        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-        public_key = private_key.public_key()
-        # Serialize keys
-        serialized_private_key = private_key.private_bytes(
-           encoding=serialization.Encoding.PEM,
-           format=serialization.PrivateFormat.TraditionalOpenSSL,
-           encryption_algorithm=serialization.NoEncryption()
-        )
-        serialized_public_key = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        return serialized_private_key, serialized_public_key
+        if signature_scheme == key_pool.scheme:
+            # Take a pre-generated key so signing up does not wait for key generation
+            return key_pool.take()
+        return signature.generate_serialized_keys(signature_scheme)
@@ -1,6 +1,8 @@
+from database import Database
 import pickle
-from server import HEADER_SIZE, DATA_FORMAT
+from server import HEADER_SIZE, DATA_FORMAT, CRUD, REPLY_TIMEOUT, receive_frame, send_frame
 import socket
+from username_cache import username_cache
 
 
 class NodeClient:
@@ -32,3 +34,29 @@ class NodeClient:
                 pass
             finally:
                 s.close()
+
+    def sync_registry(self):
+        """
+        Catches up on the nodes registered while this node was offline by asking a peer for every node created since
+        the sync watermark, in a single round trip. Returns the amount of nodes added, or None if no peer answered.
+        """
+        database = Database()
+        for server_port in self.corresponding_server.get_servers(include_own_server=False):
+            try:
+                with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+                    s.connect((self.host, int(server_port)))
+                    # Peers only answer the node servers they know, identified by their port
+                    sync_request = (self.corresponding_server.port, database.get_sync_watermark())
+                    send_frame(s, (CRUD.get("SYNC"), sync_request))
+                    s.settimeout(REPLY_TIMEOUT)
+                    registry_rows = receive_frame(s)
+            except OSError:
+                # Connection to this server cannot be established, try the next one
+                continue
+            if registry_rows is None:
+                continue
+            amount_of_inserted_nodes = database.insert_synced_nodes(registry_rows)
+            if amount_of_inserted_nodes > 0:
+                username_cache.load()
+            return amount_of_inserted_nodes
+        return None
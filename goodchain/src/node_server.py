@@ -1,5 +1,6 @@
 from database import Database
-from server import Server, CRUD
+from server import Server, CRUD, send_frame
+from username_cache import username_cache
 
 
 class NodeServer(Server):
@@ -11,16 +12,39 @@ class NodeServer(Server):
         self.server_data_file_path = "../data/database_servers.dat"
 
     def handle_client(self, connection):
-        data = self.get_client_data(connection)
+        data = self.get_client_data(connection, close_connection=False)
         crud_operation = data[0]
-        if crud_operation == CRUD.get("ADD"):
-            new_node = data[1]
-            if new_node:
-                self.database.insert_node(new_node)
-        elif crud_operation == CRUD.get("UPDATE"):
-            updated_node = data[1]
-            if updated_node:
-                self.database.update_last_login(updated_node.username, updated_node.is_logged_in)
-        elif crud_operation == CRUD.get("REGISTER"):
-            new_server = data[1]
-            self.add_server(new_server)
+        try:
+            if crud_operation == CRUD.get("ADD"):
+                new_node = data[1]
+                if new_node and self.database.insert_node(new_node):
+                    username_cache.put(new_node.public_key, new_node.username)
+            elif crud_operation == CRUD.get("UPDATE"):
+                updated_node = data[1]
+                if updated_node:
+                    self.database.update_last_login(updated_node.username, updated_node.is_logged_in)
+            elif crud_operation == CRUD.get("REGISTER"):
+                new_server = data[1]
+                self.add_server(new_server)
+            elif crud_operation == CRUD.get("SYNC"):
+                requester_port, watermark = data[1]
+                if self.__is_registered_server(connection, requester_port):
+                    # Send every node created since the requester's watermark in a single reply
+                    send_frame(connection, self.database.get_registry_rows(watermark))
+        except OSError:
+            # The requester is not waiting for a reply anymore
+            pass
+        finally:
+            connection.close()
+
+    def __is_registered_server(self, connection, server_port):
+        """
+        Returns whether the connection comes from this host and claims the port of a registered node server.
+        The registry holds password hashes and private keys, so it is only handed to the nodes of this network.
+        """
+        try:
+            peer_host = connection.getpeername()[0]
+        except OSError:
+            return False
+        registered_ports = [int(port) for port in self.get_servers(include_own_server=False)]
+        return peer_host == self.host and isinstance(server_port, int) and server_port in registered_ports
@@ -12,8 +12,17 @@ CRUD = {
     "ADD": "ADD",
     "UPDATE": "UPDATE",
     "DELETE": "DELETE",
-    "REGISTER": "REGISTER"
+    "REGISTER": "REGISTER",
+    "SYNC": "SYNC"
 }
+# Reasons a transaction server gives for not pooling received transactions
+REJECTION_REASON = {
+    "POOLED": "The transaction is in the pool already.",
+    "MINED": "The transaction is part of the ledger already.",
+    "TOO_LARGE": "The transaction is larger than the pool allows.",
+    "POOL_FULL": "The pool is full and the transaction's fee per byte is too low to replace another transaction."
+}
+REPLY_TIMEOUT = 5  # Seconds a client waits for the reply of a server that sends one
 
 
 class Server(ABC):
@@ -32,7 +41,7 @@ class Server(ABC):
         pass
 
     @staticmethod
-    def get_client_data(connection):
+    def get_client_data(connection, close_connection=True):
         data = None
         try:
             while True:
@@ -48,8 +57,9 @@ class Server(ABC):
                         data = connection.recv(data_length)
                         break
         finally:
-            # Client is handled
-            connection.close()
+            # Client is handled, unless the server still has to reply
+            if close_connection:
+                connection.close()
             return pickle.loads(data)
 
     def start_server(self):
@@ -155,3 +165,30 @@ class Server(ABC):
     def stop_server(self):
         # Stop the running server
         self.server_is_running = False
+
+
+def send_frame(connection, data):
+    """ Sends pickled data preceded by a header holding its length """
+    frame_data = pickle.dumps(data)
+    header = str(len(frame_data)).encode(DATA_FORMAT)
+    header += b' ' * (HEADER_SIZE - len(header))
+    connection.sendall(header + frame_data)
+
+
+def receive_frame(connection):
+    """ Returns the data of a frame sent with send_frame, or None if the connection closes before a complete frame """
+    header = _receive_exactly(connection, HEADER_SIZE)
+    if not header:
+        return None
+    frame_data = _receive_exactly(connection, int(header.decode(DATA_FORMAT).strip()))
+    return pickle.loads(frame_data) if frame_data is not None else None
+
+
+def _receive_exactly(connection, length):
+    data = b''
+    while len(data) < length:
+        chunk = connection.recv(length - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
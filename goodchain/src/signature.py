@@ -1,13 +1,100 @@
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, padding, rsa
 from cryptography.hazmat.primitives import serialization
+from functools import lru_cache
+import os
+from threading import Lock
 from user_interface import UserInterface, TEXT_COLOR
 
 
-def sign(message, private_key):
-    message = bytes(str(message), 'utf-8')
-    private_key = serialization.load_pem_private_key(private_key, password=None)
+# Signature schemes
+RSA = 0  # RSA-PSS over a 2048-bit key, the scheme of every account created before schemes were selectable
+ED25519 = 1
+ECDSA = 2  # ECDSA over the P-256 curve
+SIGNATURE_SCHEMES = {
+    RSA: "RSA-PSS (2048-bit)",
+    ED25519: "Ed25519",
+    ECDSA: "ECDSA (P-256)"
+}
+DEFAULT_SIGNATURE_SCHEME = RSA
+
+KEY_CACHE_SIZE = 256  # Amount of parsed keys of each kind kept before the least recently used are evicted
+PARALLEL_VERIFICATION_THRESHOLD = 16  # Smaller batches are verified in process, a worker pool costs more than it saves
+# Blocks hold few transactions, so in practice the chain audit and catching up on many blocks use the worker pool
+_executor = None
+_executor_workers = None
+_executor_lock = Lock()
+
+
+def encode_message(message):
+    """ Returns canonically encoded messages as they are and the text form of legacy messages """
+    if isinstance(message, bytes):
+        return message
+    return bytes(str(message), 'utf-8')
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_private_key(serialized_private_key: bytes):
+    """ Returns the parsed private key, PEM parsing is done once per key """
+    return serialization.load_pem_private_key(serialized_private_key, password=None)
+
+
+@lru_cache(maxsize=KEY_CACHE_SIZE)
+def load_public_key(serialized_public_key: bytes):
+    """ Returns the parsed public key, PEM parsing is done once per key """
+    return serialization.load_pem_public_key(serialized_public_key)
+
+
+def generate_serialized_keys(scheme=DEFAULT_SIGNATURE_SCHEME):
+    """ Returns a serialized private- and public key of the given signature scheme """
+    if scheme == RSA:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        # RSA keys keep the format accounts have always stored
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    elif scheme == ED25519:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.PKCS8
+    elif scheme == ECDSA:
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        raise ValueError(f"Unknown signature scheme {scheme}.")
+
+    serialized_private_key = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=private_format,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+    serialized_public_key = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return serialized_private_key, serialized_public_key
+
+
+def get_scheme(serialized_key: bytes):
+    """ Returns the signature scheme a serialized private- or public key belongs to """
+    if b"PRIVATE KEY" in serialized_key:
+        key = load_private_key(serialized_key)
+    else:
+        key = load_public_key(serialized_key)
+    if isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey)):
+        return ED25519
+    if isinstance(key, (ec.EllipticCurvePrivateKey, ec.EllipticCurvePublicKey)):
+        return ECDSA
+    return RSA
+
+
+def sign(message, private_key, scheme=DEFAULT_SIGNATURE_SCHEME):
+    message = encode_message(message)
+    private_key = load_private_key(private_key)
+    if scheme == ED25519:
+        return private_key.sign(message)
+    if scheme == ECDSA:
+        return private_key.sign(message, ec.ECDSA(hashes.SHA256()))
     signature = private_key.sign(
         message,
         padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
@@ -17,20 +104,73 @@ def sign(message, private_key):
     return signature
 
 
-def verify(message, signature, pbc_ser):
-    message = bytes(str(message), 'utf-8')
-    public_key = serialization.load_pem_public_key(pbc_ser)
+def verify(message, signature, pbc_ser, scheme=DEFAULT_SIGNATURE_SCHEME):
+    message = encode_message(message)
+    public_key = load_public_key(pbc_ser)
     try:
-        public_key.verify(
-            signature,
-            message,
-            padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
-                        salt_length=padding.PSS.MAX_LENGTH),
-            hashes.SHA256()
-        )
+        if scheme == ED25519:
+            if not isinstance(public_key, ed25519.Ed25519PublicKey):
+                return False
+            public_key.verify(signature, message)
+        elif scheme == ECDSA:
+            if not isinstance(public_key, ec.EllipticCurvePublicKey):
+                return False
+            public_key.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+        else:
+            if not isinstance(public_key, rsa.RSAPublicKey):
+                return False
+            public_key.verify(
+                signature,
+                message,
+                padding.PSS(mgf=padding.MGF1(hashes.SHA256()),
+                            salt_length=padding.PSS.MAX_LENGTH),
+                hashes.SHA256()
+            )
         return True
     except InvalidSignature:
         return False
     except:
         print(UserInterface.format_text("An error occurred, please try again.", TEXT_COLOR.get("RED")))
         return False
+
+
+def verify_batch(requests, workers=None):
+    """
+    Returns the verification result of each (message, signature, public key, scheme) request, in order.
+    Large batches are spread over a pool of worker processes.
+    """
+    requests = list(requests)
+    workers = max(1, workers or os.cpu_count() or 1)
+    if workers > 1 and len(requests) >= PARALLEL_VERIFICATION_THRESHOLD:
+        try:
+            executor = _get_executor(workers)
+            chunk_size = max(1, len(requests) // (workers * 4))
+            return list(executor.map(_verify_request, requests, chunksize=chunk_size))
+        except (OSError, BrokenProcessPool):
+            # Worker processes cannot be started here, fall back to this process
+            _discard_executor()
+    return [_verify_request(request) for request in requests]
+
+
+def _get_executor(workers):
+    """ Returns the worker process pool, which is started once and reused by later batches """
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _discard_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _verify_request(request):
+    return verify(*request)
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from hashlib import sha256
+import os
+import pickle
+import signature
+import struct
+from threading import Lock
+
+
+CACHE_PATH = "../data/signature_cache.dat"
+DEFAULT_CAPACITY = 10000  # Amount of verification results kept before the least recently used are evicted
+
+
+class VerificationCache:
+    """ Bounded LRU cache of signature verification results, keyed by everything a verification depends on """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, path=CACHE_PATH):
+        self.capacity = capacity
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.__results = OrderedDict()
+        self.__is_loaded = False
+
+    @staticmethod
+    def get_key(transaction_id, message, signature_value, public_key, scheme=signature.DEFAULT_SIGNATURE_SCHEME):
+        """ Returns a digest of the transaction id, the signed message, the signature, the public key and the scheme """
+        digest = sha256()
+        for part in (transaction_id.bytes, signature.encode_message(message), signature_value or b"", public_key):
+            digest.update(struct.pack(">I", len(part)))
+            digest.update(part)
+        if scheme != signature.RSA:
+            # RSA keys stay as they were, so results cached before schemes were selectable remain valid
+            digest.update(bytes((scheme,)))
+        return digest.digest()
+
+    def verify(self, transaction_id, message, signature_value, public_key, scheme=signature.DEFAULT_SIGNATURE_SCHEME):
+        """ Returns the cached verification result or verifies the signature and caches the result """
+        key = self.get_key(transaction_id, message, signature_value, public_key, scheme)
+        with self.lock:
+            self.__load()
+            result = self.__results.get(key)
+            if result is not None:
+                self.hits += 1
+                self.__results.move_to_end(key)
+                return result
+            self.misses += 1
+
+        result = signature.verify(message, signature_value, public_key, scheme)
+        self.put(key, result)
+        return result
+
+    def verify_many(self, requests, workers=None):
+        """
+        Returns the result of every (transaction id, message, signature, public key, scheme) request, in order.
+        Requests that are not cached yet are verified spread over worker processes, and their results are cached.
+        """
+        keys = [self.get_key(*request) for request in requests]
+        results = {}
+        uncached_requests = {}
+        with self.lock:
+            self.__load()
+            for key, request in zip(keys, requests):
+                if key in results or key in uncached_requests:
+                    continue
+                result = self.__results.get(key)
+                if result is not None:
+                    self.hits += 1
+                    self.__results.move_to_end(key)
+                    results[key] = result
+                else:
+                    uncached_requests[key] = request
+            self.misses += len(uncached_requests)
+
+        verified_results = signature.verify_batch([request[1:] for request in uncached_requests.values()], workers)
+        for key, result in zip(uncached_requests, verified_results):
+            self.put(key, result)
+            results[key] = result
+        return [results[key] for key in keys]
+
+    def put(self, key, result):
+        with self.lock:
+            self.__results[key] = result
+            self.__results.move_to_end(key)
+            while len(self.__results) > self.capacity:
+                self.__results.popitem(last=False)
+
+    def get_stats(self):
+        """ Returns the hit/miss counters and the current size of the cache """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.__results),
+            "capacity": self.capacity
+        }
+
+    def save(self):
+        """ Persists the cached results, least recently used first, so they survive a restart """
+        with self.lock:
+            if not self.__is_loaded:
+                # Nothing was looked up, the file on disk is still up to date
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "wb") as cache_file:
+                pickle.dump(list(self.__results.items()), cache_file)
+
+    def __load(self):
+        """ Loads persisted results once, before the first lookup """
+        if self.__is_loaded:
+            return
+        self.__is_loaded = True
+        try:
+            with open(self.path, "rb") as cache_file:
+                persisted_results = pickle.load(cache_file)
+        except (FileNotFoundError, EOFError):
+            # There is no cache yet
+            return
+        for key, result in persisted_results[-self.capacity:]:
+            self.__results[key] = result
+
+
+verification_cache = VerificationCache()
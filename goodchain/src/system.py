@@ -1,8 +1,12 @@
+from balance_index import balance_index
 from hashlib import sha256
-from ledger import path as ledger_path
+from ledger import Ledger, path as ledger_path, store as ledger_store
+from signature_cache import verification_cache
 from transaction import Transaction, REWARD
-from transaction_pool import TransactionPool, path as transaction_pool_path
+from transaction_deduplicator import transaction_deduplicator
+from transaction_pool import TransactionPool, path as transaction_pool_path, store as transaction_pool_store
 from user_interface import UserInterface, TEXT_COLOR
+from username_cache import username_cache
 
 
 SYSTEM_HASH_PATH = "../data/system.dat"
@@ -33,12 +37,25 @@ class System:
             print(UserInterface.format_text(error_text, TEXT_COLOR.get("RED")))
             self.exit()
         else:
+            # Move a legacy ledger and transaction pool into their stores and seal the result
+            Ledger.import_legacy_ledger()
+            TransactionPool.import_legacy_pool()
+            balance_index.open()
+            username_cache.load()
+            self.seal()
             return True
 
+    def seal(self):
+        """ Saves the hash of the current system's data files as the trusted one """
+        self.system_hash = self.__compute_hash()
+        self.__set_system_hash(self.system_hash)
+
     def exit(self):
         """ Exits the system in the right way """
-        current_system_hash = self.__compute_hash()
-        self.__set_system_hash(current_system_hash)
+        verification_cache.save()
+        transaction_deduplicator.save()
+        transaction_pool_store.close()
+        self.seal()
         exit()
 
     def __get_system_hash(self):
@@ -75,10 +92,31 @@ class System:
         if ledger is not None:
             digest.update(ledger)
 
+        for ledger_store_path in ledger_store.get_file_paths():
+            digest.update(self.__get_file_data(ledger_store_path))
+
+        transaction_pool_store_paths = transaction_pool_store.get_file_paths()
         transaction_pool = self.__get_file_data(transaction_pool_path)
-        if transaction_pool is not None:
+        if transaction_pool is not None and transaction_pool_path not in transaction_pool_store_paths:
             digest.update(transaction_pool)
 
+        for transaction_pool_store_path in transaction_pool_store_paths:
+            digest.update(self.__get_file_data(transaction_pool_store_path))
+
+        # Cached verification results are trusted on startup, so they are protected like the chain itself
+        signature_cache = self.__get_file_data(verification_cache.path)
+        if signature_cache is not None:
+            digest.update(signature_cache)
+
+        # Balances decide what nodes may spend, so they are protected like the chain itself
+        balances = self.__get_file_data(balance_index.path)
+        if balances is not None:
+            digest.update(balances)
+
+        ledger_transaction_ids = self.__get_file_data(transaction_deduplicator.path)
+        if ledger_transaction_ids is not None:
+            digest.update(ledger_transaction_ids)
+
         return digest.hexdigest()
 
     def __get_file_data(self, path):
@@ -1,7 +1,10 @@
-from database import Database
+from canonical import TRANSACTION_ENCODING_VERSION, encode_transaction_message
 import signature
+from signature import RSA
+from signature_cache import verification_cache
 from uuid import uuid4
 from user_interface import UserInterface, TEXT_COLOR
+from username_cache import username_cache
 
 
 NORMAL = 0
@@ -13,9 +16,12 @@ class Transaction:
     output = None
     signature = None
     extra_required_signature = None
+    encoding_version = 0  # Transactions created before the canonical encoding are signed over their text form
+    signature_scheme = RSA  # Transactions created before schemes were selectable are signed with RSA
 
     def __init__(self, transaction_type=NORMAL, transaction_fee=0):
         self.id = uuid4()
+        self.encoding_version = TRANSACTION_ENCODING_VERSION
         self.type = transaction_type
         self.transaction_fee = transaction_fee
         self.valid = None # To be determined by mining process
@@ -30,12 +36,18 @@ class Transaction:
         self.extra_required_signature = addr
 
     def sign(self, private):
+        # The scheme follows from the signer's key and is covered by the signature itself
+        self.signature_scheme = signature.get_scheme(private)
         message = self.__gather_transaction_data()
-        new_signature = signature.sign(message, private)
+        new_signature = signature.sign(message, private, self.signature_scheme)
         self.signature = new_signature
 
-    def is_valid(self):
-        """ Returns whether a transaction is valid or not """
+    def is_valid(self, signature_verdicts=None):
+        """
+        Returns whether a transaction is valid or not.
+        signature_verdicts optionally maps public keys to the verification results of their signature that are known
+        already, other signatures are verified through the cache.
+        """
         if self.type == REWARD:
             if self.input and self.output:
                 return False
@@ -52,13 +64,13 @@ class Transaction:
             if amount < 0 or amount == 0:
                 return False
             # Validate signature
-            if not signature.verify(message, self.signature, addr):
+            if not self.__is_signed_by(addr, message, signature_verdicts):
                 return False
             total_in = total_in + amount
 
             # Validate extra required signatures
             if self.extra_required_signature:
-                if not signature.verify(message, self.signature, self.extra_required_signature):
+                if not self.__is_signed_by(self.extra_required_signature, message, signature_verdicts):
                     return False
 
             # Validate output
@@ -73,21 +85,39 @@ class Transaction:
 
             return True
 
+    def __is_signed_by(self, public_key, message, signature_verdicts):
+        if signature_verdicts is not None and public_key in signature_verdicts:
+            return signature_verdicts[public_key]
+        return verification_cache.verify(self.id, message, self.signature, public_key, self.signature_scheme)
+
+    def get_signature_requests(self):
+        """ Returns the (transaction id, message, signature, public key, scheme) checks the transaction depends on """
+        if self.type == REWARD or not self.input:
+            return []
+        message = self.__gather_transaction_data()
+        requests = [(self.id, message, self.signature, self.input[0], self.signature_scheme)]
+        if self.extra_required_signature:
+            requests.append(
+                (self.id, message, self.signature, self.extra_required_signature, self.signature_scheme)
+            )
+        return requests
+
     def __gather_transaction_data(self):
-        """ Returns a list of transaction data """
-        return [self.input, self.output, self.extra_required_signature]
+        """ Returns the transaction data covered by the signature """
+        if self.encoding_version == 0:
+            return [self.input, self.output, self.extra_required_signature]
+        return encode_transaction_message(self)
 
     def __repr__(self):
-        db = Database()
         result = "From: "
         if self.input and self.type == NORMAL:
-            sender_username = db.get_node_username_by_public_key(self.input[0])
+            sender_username = username_cache.get_username(self.input[0])
             result += sender_username
         else:
             result += "REWARD SYSTEM"
 
         result += " | To: "
-        receiver_username = db.get_node_username_by_public_key(self.output[0])
+        receiver_username = username_cache.get_username(self.output[0])
         result += receiver_username
 
         result += " | Amount: "
@@ -101,3 +131,24 @@ class Transaction:
             result += str(self.valid)
 
         return UserInterface.format_text(result, TEXT_COLOR.get("CYAN"))
+
+
+def verify_transactions(transactions: list[Transaction], workers=None):
+    """
+    Returns whether each of the transactions is valid, in order.
+    Signatures that are not cached yet are verified up front by a pool of worker processes.
+    """
+    verdicts = []
+    # Batches keep the cache from being flooded by the results of a single call
+    batch_size = max(1, verification_cache.capacity // 2)
+    for start in range(0, len(transactions), batch_size):
+        batch = transactions[start:start + batch_size]
+        batch_requests = [transaction.get_signature_requests() for transaction in batch]
+        results = iter(verification_cache.verify_many(
+            [request for requests in batch_requests for request in requests], workers
+        ))
+        for transaction, requests in zip(batch, batch_requests):
+            # The results are handed over directly, so the signatures are not looked up in the cache once more
+            signature_verdicts = {request[3]: next(results) for request in requests}
+            verdicts.append(transaction.is_valid(signature_verdicts))
+    return verdicts
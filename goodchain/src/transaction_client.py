@@ -1,5 +1,5 @@
 import pickle
-from server import HEADER_SIZE, DATA_FORMAT
+from server import HEADER_SIZE, DATA_FORMAT, CRUD, REPLY_TIMEOUT, receive_frame
 from transaction import Transaction
 import socket
 
@@ -10,6 +10,11 @@ class TransactionClient:
         self.corresponding_server = corresponding_server
 
     def broadcast_change(self, crud_operation, transactions: list[Transaction]):
+        """
+        Sends the change to every other transaction server.
+        Returns the reason per transaction id for added transactions that servers refused to pool.
+        """
+        rejections = {}
         for server_port in self.corresponding_server.get_servers(include_own_server=False):
             try:
                 # Create a new socket for each connection
@@ -28,8 +33,14 @@ class TransactionClient:
                         s.send(header)
                         # Send the actual data
                         s.send(block_data)
+                        if crud_operation == CRUD.get("ADD"):
+                            s.settimeout(REPLY_TIMEOUT)
+                            reply = receive_frame(s)
+                            if reply:
+                                rejections.update(reply)
             except OSError as os_error:
                 # Connection to this server cannot be established.
                 pass
             finally:
                 s.close()
+        return rejections
@@ -0,0 +1,106 @@
+import os
+import pickle
+from threading import RLock
+
+
+LEDGER_INDEX_PATH = "../data/ledger_transaction_ids.dat"
+
+
+class TransactionDeduplicator:
+    """
+    Drops received transactions that are already pooled or already part of the ledger.
+    The ids of the ledger's transactions are kept in a set that is persisted together with the height and block
+    hash it covers, so only blocks added since are read on the next start.
+    """
+
+    def __init__(self, path=LEDGER_INDEX_PATH):
+        self.path = path
+        self.lock = RLock()
+        self.accepted = 0
+        self.pool_duplicates = 0
+        self.ledger_duplicates = 0
+        self.__ledger_transaction_ids = None
+        self.__indexed_height = -1
+        self.__tip_hash = None
+
+    def filter(self, transactions, is_pooled, rejections=None):
+        """
+        Returns the transactions that are neither pooled, part of the ledger nor repeated within the batch.
+        is_pooled tells whether a transaction id is in the pool already.
+        The reasons for dropping transactions are added by id to the optional rejections dictionary.
+        """
+        if rejections is None:
+            rejections = {}
+        new_transactions = []
+        with self.lock:
+            self.__refresh()
+            batch_transaction_ids = set()
+            for transaction in transactions:
+                if not transaction:
+                    continue
+                if transaction.id in self.__ledger_transaction_ids:
+                    self.ledger_duplicates += 1
+                    rejections[transaction.id] = "MINED"
+                elif transaction.id in batch_transaction_ids or is_pooled(transaction.id):
+                    self.pool_duplicates += 1
+                    rejections[transaction.id] = "POOLED"
+                else:
+                    batch_transaction_ids.add(transaction.id)
+                    new_transactions.append(transaction)
+            self.accepted += len(new_transactions)
+        return new_transactions
+
+    def is_in_ledger(self, transaction_id):
+        with self.lock:
+            self.__refresh()
+            return transaction_id in self.__ledger_transaction_ids
+
+    def get_stats(self):
+        """ Returns how many received transactions were accepted and how many duplicates were dropped """
+        return {
+            "accepted": self.accepted,
+            "pool_duplicates": self.pool_duplicates,
+            "ledger_duplicates": self.ledger_duplicates
+        }
+
+    def save(self):
+        """ Persists the ledger's transaction ids so they do not have to be collected again on the next start """
+        with self.lock:
+            if self.__ledger_transaction_ids is None:
+                # Nothing was looked up, the file on disk is still up to date
+                return
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, "wb") as index_file:
+                pickle.dump((self.__indexed_height, self.__tip_hash, self.__ledger_transaction_ids), index_file)
+
+    def __refresh(self):
+        """ Adds the transaction ids of blocks added to the ledger since the last refresh """
+        from ledger import Ledger
+        if self.__ledger_transaction_ids is None:
+            self.__load()
+
+        # The set is rebuilt once the indexed tip has been replaced or removed
+        indexed_block = Ledger.get_block(self.__indexed_height) if self.__indexed_height >= 0 else None
+        if self.__indexed_height >= 0 and (indexed_block is None or indexed_block.block_hash != self.__tip_hash):
+            self.__ledger_transaction_ids = set()
+            self.__indexed_height, self.__tip_hash = -1, None
+
+        chain_length = Ledger.get_chain_length()
+        if self.__indexed_height + 1 >= chain_length:
+            return
+        for block in Ledger.get_blocks(self.__indexed_height + 1, chain_length):
+            self.__ledger_transaction_ids.update(transaction.id for transaction in block.data)
+            self.__tip_hash = block.block_hash
+        self.__indexed_height = chain_length - 1
+
+    def __load(self):
+        self.__ledger_transaction_ids = set()
+        try:
+            with open(self.path, "rb") as index_file:
+                self.__indexed_height, self.__tip_hash, self.__ledger_transaction_ids = pickle.load(index_file)
+        except (FileNotFoundError, EOFError):
+            # There is no index yet
+            pass
+
+
+transaction_deduplicator = TransactionDeduplicator()
@@ -1,9 +1,52 @@
-import pickle
+from balance_index import balance_index
+import json
+import os
 from transaction import Transaction, REWARD
+from transaction_deduplicator import transaction_deduplicator
+from transaction_pool_store import JournalTransactionPoolStore, SqliteTransactionPoolStore
 from user_interface import UserInterface, WHITESPACE, TEXT_COLOR
 
 
-path = "../data/transaction_pool.dat"
+path = "../data/transaction_pool.dat"  # Single file pool of earlier versions, imported into the store on startup
+store_path = "../data/transaction_pool.db"
+STORE_BACKENDS = ("sqlite", "journal")
+DEFAULT_STORE_BACKEND = "sqlite"
+STORE_BACKEND_ENVIRONMENT_VARIABLE = "GOODCHAIN_TRANSACTION_POOL_BACKEND"
+
+
+def create_store(backend=DEFAULT_STORE_BACKEND):
+    """ Returns the transaction pool store of the given backend """
+    if backend == "sqlite":
+        return SqliteTransactionPoolStore(store_path)
+    elif backend == "journal":
+        # The journal continues in the file the single file pool has always used
+        return JournalTransactionPoolStore(path)
+    raise ValueError(f"Unknown transaction pool backend '{backend}', choose one of {STORE_BACKENDS}.")
+
+
+store = create_store(os.environ.get(STORE_BACKEND_ENVIRONMENT_VARIABLE, DEFAULT_STORE_BACKEND))
+
+LIMITS_PATH = "../data/transaction_pool.json"
+# Defaults that can be overridden per key in the limits file
+DEFAULT_LIMITS = {
+    "maximum_transactions": 5000,
+    "maximum_bytes": 8 * 1024 * 1024
+}
+
+
+def get_limits():
+    """ Returns the pool limits, with the values of the limits file taking precedence """
+    limits = dict(DEFAULT_LIMITS)
+    try:
+        with open(LIMITS_PATH, "r") as limits_file:
+            limits.update(json.load(limits_file))
+    except FileNotFoundError:
+        # There is no limits file, the defaults apply
+        pass
+    except ValueError:
+        # The limits file cannot be parsed, the defaults apply
+        pass
+    return limits
 
 
 class TransactionPool:
@@ -11,39 +54,80 @@ class TransactionPool:
 
     @staticmethod
     def add_transaction(transaction: Transaction):
-        """ Adds transaction to the pool """
-        if transaction:
-            with open(path, "ab") as pool:
-                pickle.dump(transaction, pool)
+        """
+        Adds transaction to the pool, evicting the transactions that pay the least per byte if the pool is full.
+        Returns the reason the transaction was refused, or None once it is pooled.
+        """
+        if not transaction:
+            return None
+        with store.lock:
+            rejection_reason = TransactionPool.__make_room(transaction)
+            if rejection_reason is None:
+                balance_index.apply_pending(store.get_transaction(transaction.id), -1)
+                store.add(transaction)
+                balance_index.apply_pending(transaction)
+        return rejection_reason
+
+    @staticmethod
+    def ingest_transactions(transactions: list[Transaction], rejections: dict = None):
+        """
+        Adds received transactions to the pool, except those that are pooled or mined already or do not fit.
+        The reasons for refusing transactions are added by id to the optional rejections dictionary.
+        """
+        if rejections is None:
+            rejections = {}
+        new_transactions = transaction_deduplicator.filter(
+            transactions, lambda transaction_id: store.get_transaction(transaction_id) is not None, rejections
+        )
+        pooled_transactions = []
+        for transaction in new_transactions:
+            rejection_reason = TransactionPool.add_transaction(transaction)
+            if rejection_reason is None:
+                pooled_transactions.append(transaction)
+            else:
+                rejections[transaction.id] = rejection_reason
+        return pooled_transactions
 
     @staticmethod
     def remove_transactions(transactions: list[Transaction]):
         """ Removes transactions from the pool """
-        current_transactions = TransactionPool.get_transactions()
-        transactions_to_keep = [tx for tx in current_transactions if not any(t.id == tx.id for t in transactions)]
-
-        # Overwrite transaction pool file
-        with open(path, "wb") as pool:
-            for transaction in transactions_to_keep:
-                pickle.dump(transaction, pool)
+        with store.lock:
+            for transaction in transactions:
+                balance_index.apply_pending(store.get_transaction(transaction.id), -1)
+            store.remove([transaction.id for transaction in transactions])
 
     @staticmethod
     def update_transactions(updated_transactions: list[Transaction]):
         """ Updates the pool with the passed transactions """
-        transactions = TransactionPool.get_transactions()
-
-        # Create a dictionary of updated transactions for quick lookup
-        updated_transactions_dict = {ut.id: ut for ut in updated_transactions}
+        with store.lock:
+            for transaction in updated_transactions:
+                pooled_transaction = store.get_transaction(transaction.id)
+                if pooled_transaction is not None:
+                    balance_index.apply_pending(pooled_transaction, -1)
+                    balance_index.apply_pending(transaction)
+            store.update(updated_transactions)
 
-        # Update transactions in the pool
-        for i, transaction in enumerate(transactions):
-            if transaction.id in updated_transactions_dict:
-                transactions[i] = updated_transactions_dict[transaction.id]
-
-        # Write the updated transactions back to the file
-        with open(path, "wb") as pool:
-            for transaction in transactions:
-                pickle.dump(transaction, pool)
+    @staticmethod
+    def __make_room(transaction: Transaction):
+        """ Evicts the transactions paying the least per byte until the transaction fits, if it pays more """
+        if transaction.type == REWARD:
+            # Rewards are granted by the system, they are never refused or evicted
+            return None
+        limits = get_limits()
+        size = store.get_size(transaction)
+        if size > limits["maximum_bytes"]:
+            return "TOO_LARGE"
+        fee_rate = store.get_fee_rate(transaction, size)
+        while True:
+            amount_of_transactions, amount_of_bytes = store.get_usage()
+            if amount_of_transactions < limits["maximum_transactions"] and \
+                    amount_of_bytes + size <= limits["maximum_bytes"]:
+                return None
+            cheapest_transaction = store.get_lowest_fee_rate_transaction()
+            if cheapest_transaction is None or \
+                    store.get_fee_rate(cheapest_transaction, store.get_size(cheapest_transaction)) >= fee_rate:
+                return "POOL_FULL"
+            TransactionPool.remove_transactions([cheapest_transaction])
 
     @staticmethod
     def show_transaction_pool(with_reward_transactions=True, with_invalid_transactions=True):
@@ -61,17 +145,29 @@ class TransactionPool:
     @staticmethod
     def get_transactions(with_reward_transactions=True):
         """ Returns a list of transactions out of the pool """
-        transactions = []
-        try:
-            with open(path, "rb") as pool:
-                while True:
-                    transaction = pickle.load(pool)
-                    if with_reward_transactions or transaction.type != REWARD:
-                        transactions.append(transaction)
-        except FileNotFoundError:
-            # There is no transaction pool yet.
-            pass
-        except EOFError:
-            # No more lines to read from file.
-            pass
-        return transactions
+        return store.get_transactions(with_reward_transactions)
+
+    @staticmethod
+    def get_transaction(transaction_id):
+        """ Returns the pooled transaction with the given id or None """
+        return store.get_transaction(transaction_id)
+
+    @staticmethod
+    def get_transactions_by_sender(public_key):
+        """ Returns the pooled transactions sent from the given public key """
+        return store.get_transactions_by_sender(public_key)
+
+    @staticmethod
+    def get_transactions_by_receiver(public_key):
+        """ Returns the pooled transactions sent to the given public key """
+        return store.get_transactions_by_receiver(public_key)
+
+    @staticmethod
+    def get_transactions_by_fee(limit: int):
+        """ Returns the limit best-paying transactions of the pool, the oldest first among equal fees """
+        return store.get_transactions_by_fee(limit)
+
+    @staticmethod
+    def import_legacy_pool():
+        """ Moves the transactions of a legacy single file pool into the store """
+        store.import_legacy_pool(path)
@@ -0,0 +1,484 @@
+from abc import ABC, abstractmethod
+from file_lock import file_lock
+import heapq
+import os
+import pickle
+from server import CRUD
+import sqlite3
+from threading import RLock, Thread
+from transaction import REWARD
+
+
+COMPACTION_THRESHOLD = 1000  # Amount of obsolete journal records before the journal is rewritten
+
+
+class TransactionPoolStore(ABC):
+    """ Base class for the storage behind the transaction pool """
+
+    @abstractmethod
+    def __len__(self):
+        pass
+
+    @abstractmethod
+    def add(self, transaction):
+        """ Adds a transaction, a transaction that is already pooled is replaced in place """
+        pass
+
+    @abstractmethod
+    def remove(self, transaction_ids):
+        """ Removes the transactions with the given ids """
+        pass
+
+    @abstractmethod
+    def update(self, transactions):
+        """ Replaces the pooled transactions that have the same ids """
+        pass
+
+    @abstractmethod
+    def get_transaction(self, transaction_id):
+        """ Returns the pooled transaction with the given id or None """
+        pass
+
+    @abstractmethod
+    def get_transactions(self, with_reward_transactions=True):
+        """ Returns the pooled transactions in the order they were added """
+        pass
+
+    @abstractmethod
+    def get_transactions_by_sender(self, public_key):
+        pass
+
+    @abstractmethod
+    def get_transactions_by_receiver(self, public_key):
+        pass
+
+    def get_transactions_by_fee(self, limit):
+        """
+        Returns at most limit transactions, the highest fee first and the oldest first among equal fees.
+        Transactions flagged invalid are left out, they can never be mined.
+        """
+        pooled_transactions = [
+            entry for entry in enumerate(self.get_transactions()) if entry[1].valid is not False
+        ]
+        return [
+            transaction for _, transaction in heapq.nsmallest(
+                limit, pooled_transactions, key=lambda entry: (-float(entry[1].transaction_fee or 0), entry[0])
+            )
+        ]
+
+    @abstractmethod
+    def get_usage(self):
+        """ Returns the amount of pooled transactions and their total size in bytes """
+        pass
+
+    @abstractmethod
+    def get_lowest_fee_rate_transaction(self):
+        """ Returns the newest of the non-reward transactions paying the lowest fee per byte, or None """
+        pass
+
+    @abstractmethod
+    def get_file_paths(self):
+        """ Returns the paths of the files the store consists of """
+        pass
+
+    def close(self):
+        """ Finishes pending background work so the store's files no longer change """
+        pass
+
+    def import_legacy_pool(self, legacy_path):
+        """ Moves the transactions of a legacy pickled pool file into the store """
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, "rb") as pool:
+                while True:
+                    self.add(pickle.load(pool))
+        except EOFError:
+            # No more lines to read from file
+            pass
+        os.replace(legacy_path, legacy_path + ".migrated")
+
+    @staticmethod
+    def get_sender(transaction):
+        if transaction.type == REWARD or not transaction.input:
+            return None
+        return transaction.input[0]
+
+    @staticmethod
+    def get_receiver(transaction):
+        return transaction.output[0] if transaction.output else None
+
+    @staticmethod
+    def get_size(transaction):
+        """ Returns the amount of bytes a transaction takes up in the pool """
+        return len(pickle.dumps(transaction))
+
+    @staticmethod
+    def get_fee_rate(transaction, size):
+        return float(transaction.transaction_fee or 0) / size
+
+
+class SqliteTransactionPoolStore(TransactionPoolStore):
+    """
+    Stores pickled transactions in a table keyed by transaction id, with indexes on sender and receiver.
+    Every change is a single indexed statement instead of a rewrite of the whole pool.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = RLock()
+        self.__connection = None
+
+    def __len__(self):
+        return self.__fetch_one("SELECT COUNT(*) FROM TransactionPool")[0]
+
+    def add(self, transaction):
+        with self.lock:
+            self.__get_connection().execute(
+                """ INSERT INTO TransactionPool (Id, Type, Sender, Receiver, Fee, Size, Valid, Data)
+                    VALUES (:id, :type, :sender, :receiver, :fee, :size, :valid, :data)
+                    ON CONFLICT (Id) DO UPDATE
+                    SET Type = excluded.Type, Sender = excluded.Sender, Receiver = excluded.Receiver,
+                        Fee = excluded.Fee, Size = excluded.Size, Valid = excluded.Valid, Data = excluded.Data
+                    """, self.__get_row(transaction))
+            self.__connection.commit()
+
+    def remove(self, transaction_ids):
+        with self.lock:
+            self.__get_connection().executemany(
+                "DELETE FROM TransactionPool WHERE Id = ?",
+                [(transaction_id.bytes,) for transaction_id in transaction_ids]
+            )
+            self.__connection.commit()
+
+    def update(self, transactions):
+        with self.lock:
+            self.__get_connection().executemany(
+                """ UPDATE TransactionPool
+                    SET Type = :type, Sender = :sender, Receiver = :receiver, Fee = :fee, Size = :size,
+                        Valid = :valid, Data = :data
+                    WHERE Id = :id
+                    """, [self.__get_row(transaction) for transaction in transactions])
+            self.__connection.commit()
+
+    def get_transaction(self, transaction_id):
+        row = self.__fetch_one("SELECT Data FROM TransactionPool WHERE Id = ?", (transaction_id.bytes,))
+        return pickle.loads(row[0]) if row else None
+
+    def get_transactions(self, with_reward_transactions=True):
+        if with_reward_transactions:
+            return self.__select("SELECT Data FROM TransactionPool ORDER BY Sequence")
+        return self.__select("SELECT Data FROM TransactionPool WHERE Type != ? ORDER BY Sequence", (REWARD,))
+
+    def get_transactions_by_sender(self, public_key):
+        return self.__select("SELECT Data FROM TransactionPool WHERE Sender = ? ORDER BY Sequence", (public_key,))
+
+    def get_transactions_by_receiver(self, public_key):
+        return self.__select("SELECT Data FROM TransactionPool WHERE Receiver = ? ORDER BY Sequence", (public_key,))
+
+    def get_transactions_by_fee(self, limit):
+        # The fee index only holds transactions not flagged invalid and hands them out in priority order,
+        # only the selected rows are read
+        return self.__select(
+            "SELECT Data FROM TransactionPool WHERE Valid IS NOT 0 ORDER BY Fee DESC, Sequence LIMIT ?", (limit,)
+        )
+
+    def get_usage(self):
+        count, size = self.__fetch_one("SELECT COUNT(*), COALESCE(SUM(Size), 0) FROM TransactionPool")
+        return count, size
+
+    def get_lowest_fee_rate_transaction(self):
+        # The fee rate index hands out the cheapest row first
+        row = self.__fetch_one(
+            "SELECT Data FROM TransactionPool WHERE Type != ? ORDER BY Fee / Size, Sequence DESC LIMIT 1", (REWARD,)
+        )
+        return pickle.loads(row[0]) if row else None
+
+    def get_file_paths(self):
+        return [self.path] if os.path.exists(self.path) else []
+
+    def __select(self, query, parameters=()):
+        with self.lock:
+            rows = self.__get_connection().execute(query, parameters).fetchall()
+        return [pickle.loads(row[0]) for row in rows]
+
+    def __fetch_one(self, query, parameters=()):
+        with self.lock:
+            return self.__get_connection().execute(query, parameters).fetchone()
+
+    def __get_connection(self):
+        """ Returns the connection to the pool database, the table is created on first use """
+        if self.__connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self.__connection = sqlite3.connect(self.path, check_same_thread=False)
+            self.__connection.execute(
+                """ CREATE TABLE IF NOT EXISTS TransactionPool (
+                    Sequence INTEGER PRIMARY KEY AUTOINCREMENT,
+                    Id BLOB NOT NULL UNIQUE,
+                    Type INTEGER NOT NULL,
+                    Sender BLOB,
+                    Receiver BLOB,
+                    Fee REAL NOT NULL DEFAULT 0,
+                    Size INTEGER NOT NULL DEFAULT 1,
+                    Valid INTEGER,
+                    Data BLOB NOT NULL
+                )"""
+            )
+            columns = [column[1] for column in self.__connection.execute("PRAGMA table_info(TransactionPool)")]
+            if "Size" not in columns:
+                # Pools created before the size limit do not know the size of their transactions yet
+                self.__connection.execute("ALTER TABLE TransactionPool ADD COLUMN Size INTEGER NOT NULL DEFAULT 1")
+                self.__connection.execute("UPDATE TransactionPool SET Size = MAX(LENGTH(Data), 1)")
+            if "Valid" not in columns:
+                # Pools created before invalid transactions were skipped keep the flag in the pickled data only
+                self.__connection.execute("ALTER TABLE TransactionPool ADD COLUMN Valid INTEGER")
+                self.__connection.executemany(
+                    "UPDATE TransactionPool SET Valid = ? WHERE Sequence = ?", [
+                        (self.__get_valid_flag(pickle.loads(data)), sequence)
+                        for sequence, data in self.__connection.execute("SELECT Sequence, Data FROM TransactionPool")
+                    ]
+                )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS TransactionPoolSender ON TransactionPool (Sender)"
+            )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS TransactionPoolReceiver ON TransactionPool (Receiver)"
+            )
+            self.__connection.execute("DROP INDEX IF EXISTS TransactionPoolFee")
+            self.__connection.execute(
+                """ CREATE INDEX IF NOT EXISTS TransactionPoolValidFee ON TransactionPool (Fee DESC, Sequence)
+                    WHERE Valid IS NOT 0"""
+            )
+            self.__connection.execute(
+                "CREATE INDEX IF NOT EXISTS TransactionPoolFeeRate ON TransactionPool (Fee / Size, Sequence DESC)"
+            )
+            self.__connection.commit()
+        return self.__connection
+
+    def __get_row(self, transaction):
+        data = pickle.dumps(transaction)
+        return {
+            "id": transaction.id.bytes,
+            "type": transaction.type,
+            "sender": self.get_sender(transaction),
+            "receiver": self.get_receiver(transaction),
+            "fee": float(transaction.transaction_fee or 0),
+            "size": len(data),
+            "valid": self.__get_valid_flag(transaction),
+            "data": data
+        }
+
+    @staticmethod
+    def __get_valid_flag(transaction):
+        """ Returns 1 or 0 for a transaction flagged valid or invalid, None while it has not been judged yet """
+        return None if transaction.valid is None else int(bool(transaction.valid))
+
+
+class JournalTransactionPoolStore(TransactionPoolStore):
+    """
+    Stores the pool as an append-only journal of ADD, UPDATE and DELETE records that is replayed into memory.
+    Every change appends one record, a background compactor rewrites the journal once enough records are obsolete.
+    Transactions in a legacy pool file count as ADD records, so such a file is a valid journal as it is.
+    Processes sharing the journal replay and append under a file lock, so none misses the records of another.
+    """
+
+    def __init__(self, path, compaction_threshold=COMPACTION_THRESHOLD):
+        self.path = path
+        self.compaction_threshold = compaction_threshold
+        self.lock_path = path + ".lock"
+        self.lock = RLock()
+        self.__transactions = {}
+        self.__sizes = {}
+        self.__obsolete_records = 0
+        self.__replayed_offset = 0
+        self.__replayed_file_id = None
+        self.__compaction_thread = None
+
+    def __len__(self):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            return len(self.__transactions)
+
+    def add(self, transaction):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            self.__append([(CRUD.get("ADD"), transaction)])
+
+    def remove(self, transaction_ids):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            self.__append([
+                (CRUD.get("DELETE"), transaction_id) for transaction_id in transaction_ids
+                if transaction_id in self.__transactions
+            ])
+
+    def update(self, transactions):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            self.__append([
+                (CRUD.get("UPDATE"), transaction) for transaction in transactions
+                if transaction.id in self.__transactions
+            ])
+
+    def get_transaction(self, transaction_id):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            return self.__transactions.get(transaction_id)
+
+    def get_transactions(self, with_reward_transactions=True):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            return [
+                transaction for transaction in self.__transactions.values()
+                if with_reward_transactions or transaction.type != REWARD
+            ]
+
+    def get_transactions_by_sender(self, public_key):
+        return [
+            transaction for transaction in self.get_transactions() if self.get_sender(transaction) == public_key
+        ]
+
+    def get_transactions_by_receiver(self, public_key):
+        return [
+            transaction for transaction in self.get_transactions() if self.get_receiver(transaction) == public_key
+        ]
+
+    def get_usage(self):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            return len(self.__transactions), sum(self.__sizes.values())
+
+    def get_lowest_fee_rate_transaction(self):
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            candidates = [
+                (self.get_fee_rate(transaction, self.__sizes[transaction.id]), -position, transaction)
+                for position, transaction in enumerate(self.__transactions.values()) if transaction.type != REWARD
+            ]
+        return min(candidates, key=lambda candidate: candidate[:2])[2] if candidates else None
+
+    def get_file_paths(self):
+        return [self.path] if os.path.exists(self.path) else []
+
+    def import_legacy_pool(self, legacy_path):
+        if os.path.abspath(legacy_path) == os.path.abspath(self.path):
+            # The legacy pool file is read as the journal itself
+            return
+        super().import_legacy_pool(legacy_path)
+
+    def close(self):
+        with self.lock:
+            compaction_thread = self.__compaction_thread
+        if compaction_thread is not None:
+            compaction_thread.join()
+
+    def compact(self):
+        """ Rewrites the journal to one ADD record per pooled transaction """
+        with self.lock, file_lock(self.lock_path):
+            self.__replay()
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            temporary_path = self.path + ".compacting"
+            with open(temporary_path, "wb") as journal:
+                for transaction in self.__transactions.values():
+                    pickle.dump((CRUD.get("ADD"), transaction), journal)
+            os.replace(temporary_path, self.path)
+            self.__obsolete_records = 0
+            self.__replayed_offset = os.path.getsize(self.path)
+            self.__replayed_file_id = self.__get_file_id()
+
+    def __append(self, records):
+        """ Appends records to the replayed journal and applies them to the pool. The file lock must be held. """
+        if not records:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as journal:
+            start_offset = journal.tell()
+            for record in records:
+                pickle.dump(record, journal)
+            # Only the bytes written here are skipped, the records before them have been replayed
+            self.__replayed_offset += journal.tell() - start_offset
+        self.__replayed_file_id = self.__get_file_id()
+        for record in records:
+            self.__apply(record)
+
+        if self.__obsolete_records >= self.compaction_threshold and self.__compaction_thread is None:
+            self.__compaction_thread = Thread(target=self.__compact_in_background, daemon=True)
+            self.__compaction_thread.start()
+
+    def __compact_in_background(self):
+        try:
+            self.compact()
+        finally:
+            with self.lock:
+                self.__compaction_thread = None
+
+    def __replay(self):
+        """
+        Applies the records appended since the last replay, which may come from another process.
+        A journal that was rewritten in the meantime is replayed from the start. The file lock must be held.
+        """
+        file_id = self.__get_file_id()
+        if file_id is None:
+            # There is no journal (anymore)
+            self.__transactions = {}
+            self.__sizes = {}
+            self.__obsolete_records = 0
+            self.__replayed_offset = 0
+            self.__replayed_file_id = None
+            return
+        is_full_replay = file_id != self.__replayed_file_id or os.path.getsize(self.path) < self.__replayed_offset
+        if is_full_replay:
+            self.__transactions = {}
+            self.__sizes = {}
+            self.__obsolete_records = 0
+            self.__replayed_offset = 0
+        elif os.path.getsize(self.path) == self.__replayed_offset:
+            return
+
+        with open(self.path, "rb") as journal:
+            journal.seek(self.__replayed_offset)
+            while True:
+                try:
+                    record = pickle.load(journal)
+                except EOFError:
+                    # No more records to read from file
+                    break
+                except (pickle.UnpicklingError, ValueError, TypeError, AttributeError, IndexError):
+                    # The last record was cut off by a crash, it is dropped
+                    break
+                self.__apply(record)
+                self.__replayed_offset = journal.tell()
+
+        if self.__replayed_offset < os.path.getsize(self.path):
+            # No other process writes while the lock is held, so the rest was cut off by a crash.
+            # Records after a cut off one cannot be trusted, the journal continues from the last complete record
+            with open(self.path, "r+b") as journal:
+                journal.truncate(self.__replayed_offset)
+        self.__replayed_file_id = file_id
+
+    def __apply(self, record):
+        if not isinstance(record, tuple):
+            # Legacy pool files hold bare transactions
+            record = (CRUD.get("ADD"), record)
+        operation, payload = record
+        if operation == CRUD.get("DELETE"):
+            self.__sizes.pop(payload, None)
+            if self.__transactions.pop(payload, None) is not None:
+                # Both the tombstone and the record it deletes are obsolete
+                self.__obsolete_records += 2
+        elif operation == CRUD.get("UPDATE") and payload.id not in self.__transactions:
+            self.__obsolete_records += 1
+        else:
+            if payload.id in self.__transactions:
+                self.__obsolete_records += 1
+            # Replacing a key keeps its position, so the pool keeps the order in which transactions were added
+            self.__transactions[payload.id] = payload
+            self.__sizes[payload.id] = self.get_size(payload)
+
+    def __get_file_id(self):
+        """ Returns what identifies the journal file on disk, it changes when the journal is rewritten """
+        try:
+            status = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return status.st_dev, status.st_ino
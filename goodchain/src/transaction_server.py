@@ -1,5 +1,5 @@
 from transaction_pool import TransactionPool
-from server import Server, CRUD
+from server import Server, CRUD, send_frame
 
 
 class TransactionServer(Server):
@@ -10,12 +10,12 @@ class TransactionServer(Server):
         self.server_data_file_path = "../data/transaction_servers.dat"
 
     def handle_client(self, connection):
-        data = self.get_client_data(connection)
+        data = self.get_client_data(connection, close_connection=False)
         crud_operation = data[0]
+        rejections = {}
         if crud_operation == CRUD.get("ADD"):
             new_transactions = data[1]
-            for new_transaction in new_transactions:
-                TransactionPool.add_transaction(new_transaction)
+            TransactionPool.ingest_transactions(new_transactions, rejections)
         elif crud_operation == CRUD.get("UPDATE"):
             updated_transaction = data[1]
             TransactionPool.update_transactions(updated_transaction)
@@ -25,3 +25,13 @@ class TransactionServer(Server):
         elif crud_operation == CRUD.get("REGISTER"):
             new_server = data[1]
             self.add_server(new_server)
+
+        try:
+            if crud_operation == CRUD.get("ADD"):
+                # Tell the sender which transactions were not pooled and why
+                send_frame(connection, rejections)
+        except OSError:
+            # The sender is not waiting for a reply anymore
+            pass
+        finally:
+            connection.close()
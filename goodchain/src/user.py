@@ -1,12 +1,16 @@
 from database import Database
+from key_pool import key_pool
 from ledger import Ledger
 from ledger_server import LedgerServer
 from node import Node
+from node_client import NodeClient
 from node_server import NodeServer
 import re
+import signature
 from system import System
 from transaction_server import TransactionServer
 from user_interface import UserInterface, TEXT_COLOR
+from username_cache import username_cache
 
 
 class User:
@@ -43,6 +47,12 @@ class User:
         self.ledger_server.start_server()
         self.transaction_server.start_server()
 
+        # Learn about the nodes that registered while this node was offline
+        NodeClient(self.node_server).sync_registry()
+
+        # Have keys ready before anyone signs up
+        key_pool.fill_in_background()
+
     def handle_menu_user_input(self):
         """ Handles user input for the public menu interface """
         chosen_menu_item = input("-> ")
@@ -81,6 +91,7 @@ class User:
         node = self.__create_node()
         if node:
             self.database.insert_node(node)
+            username_cache.put(node.public_key, node.username)
             sign_up_reward = 50.0
             reward_transaction = System.grant_reward(node, sign_up_reward)
             node.node_client.broadcast_change(CRUD.get("ADD"), node)
@@ -148,6 +159,9 @@ class User:
             print("")
             return self.__create_node()
 
+        # Get node signature scheme
+        signature_scheme = self.__get_signature_scheme()
+
         print("Are you sure you want to proceed signing up with the information above?")
         input(self.ui.PRESS_ENTER_TO_CONTINUE)
 
@@ -155,7 +169,25 @@ class User:
         password_hash = self.get_password_hash_value(password)
 
         # Create and return node
-        return Node(self, username, password_hash)
+        return Node(self, username, password_hash, signature_scheme=signature_scheme)
+
+    def __get_signature_scheme(self):
+        """ Returns the signature scheme the user would like their keys to use """
+        print("Choose the signature scheme of your keys, or press enter to use the default.")
+        for scheme, name in signature.SIGNATURE_SCHEMES.items():
+            default_text = " (default)" if scheme == signature.DEFAULT_SIGNATURE_SCHEME else ""
+            print(f"{scheme + 1} - {name}{default_text}")
+        chosen_scheme = input("Signature scheme " + self.ui.INPUT_ARROW).strip()
+        if not chosen_scheme:
+            return signature.DEFAULT_SIGNATURE_SCHEME
+        try:
+            chosen_scheme = int(chosen_scheme) - 1
+            if chosen_scheme in signature.SIGNATURE_SCHEMES:
+                return chosen_scheme
+        except ValueError:
+            pass
+        print(self.ui.format_text("This is not an existing signature scheme, please try again.", TEXT_COLOR.get("RED")))
+        return self.__get_signature_scheme()
 
     def __validate_username(self, username):
         # Empty check
@@ -0,0 +1,66 @@
+from database import Database, get_fingerprint
+from threading import Lock
+
+
+class UsernameCache:
+    """
+    In-process map of public key fingerprints to usernames, so printing transactions does not query the database.
+    It is filled with every registered node in one query and kept up to date as nodes register.
+    """
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.lock = Lock()
+        self.__usernames = {}
+        self.__is_loaded = False
+
+    def get_username(self, public_key):
+        """ Returns the username of the node with the given public key or None if no such node is registered """
+        fingerprint = get_fingerprint(public_key)
+        with self.lock:
+            self.__load()
+            username = self.__usernames.get(fingerprint)
+            if username is not None:
+                self.hits += 1
+                return username
+            self.misses += 1
+
+        # The node may have registered without passing this cache, such as in another process
+        try:
+            username = Database().get_node_username_by_public_key(public_key)
+        except TypeError:
+            # No node has this public key
+            return None
+        self.put(public_key, username)
+        return username
+
+    def put(self, public_key, username):
+        """ Caches the username of a node that registered """
+        with self.lock:
+            self.__usernames[get_fingerprint(public_key)] = username
+
+    def load(self):
+        """ Fills the cache with every registered node """
+        with self.lock:
+            self.__is_loaded = False
+            self.__load()
+
+    def get_stats(self):
+        """ Returns the hit/miss counters and the current size of the cache """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "size": len(self.__usernames)
+        }
+
+    def __load(self):
+        if self.__is_loaded:
+            return
+        self.__usernames = dict(Database().get_usernames_by_fingerprint())
+        self.__is_loaded = True
+
+
+username_cache = UsernameCache()
@@ -1,4 +1,5 @@
-from block import block_status
+from balance_index import balance_index
+from history_index import DEFAULT_PAGE_SIZE
 from ledger import Ledger
 from transaction import REWARD
 from transaction_pool import TransactionPool
@@ -10,43 +11,21 @@ class Wallet:
     def __init__(self, owner_node):
         self.owner = owner_node
 
-    @property
-    def transactions(self):
-        """ Returns transaction history string """
-        # Get transactions from ledger
-        result = "PROCESSED TRANSACTIONS:\n"
-        credit = []
-        debet = []
-        for block in Ledger.get_blocks():
-            for transaction in block.data:
-                receiver_public_key = transaction.output[0]
-                if receiver_public_key == self.owner.public_key:
-                    credit.append(transaction)
-                elif transaction.type != REWARD and transaction.input[0] == self.owner.public_key:
-                    debet.append(transaction)
-
-        # Include grouped processed transactions
-        if len(credit) > 0:
-            result += "+ RECEIVED +\n"
-            for t in credit:
-                result += WHITESPACE + f"{t}\n"
-        if len(debet) > 0:
-            result += "- SEND -\n"
-            for t in debet:
-                result += WHITESPACE + f"{t}\n"
-
-        result += "\n"
+    def get_transaction_history(self, page_size=DEFAULT_PAGE_SIZE):
+        """ Yields pages of (block height, transaction) pairs the owner sent or received, newest first """
+        return Ledger.get_transaction_history(self.owner.public_key, page_size)
 
+    def show_transactions(self):
+        """ Prints the unprocessed transactions followed by the processed ones, page by page """
         # Get transactions from transaction pool
-        result += "UNPROCESSED TRANSACTIONS:\n"
+        result = "UNPROCESSED TRANSACTIONS:\n"
         credit = []
         debet = []
-        for transaction in TransactionPool.get_transactions():
-            receiver_public_key = transaction.output[0]
-            if transaction.type == REWARD and receiver_public_key == self.owner.public_key:
+        for transaction in TransactionPool.get_transactions_by_receiver(self.owner.public_key):
+            if transaction.type == REWARD:
                 credit.append(transaction)
-            elif transaction.type != REWARD and transaction.input[0] == self.owner.public_key:
-                debet.append(transaction)
+        for transaction in TransactionPool.get_transactions_by_sender(self.owner.public_key):
+            debet.append(transaction)
 
         # Include grouped unprocessed transactions
         if len(credit) > 0:
@@ -57,29 +36,13 @@ class Wallet:
             result += "- TO SEND -\n"
             for t in debet:
                 result += WHITESPACE + f"{t}\n"
+        print(result)
 
-        return result
+        # Get transactions from ledger
+        print("PROCESSED TRANSACTIONS:")
+        Ledger.show_transaction_history_paged(self.owner.public_key)
 
     @property
     def available_balance(self):
         """ Returns the available balance """
-        incoming = 0.0
-        outgoing = 0.0
-
-        # Check pending transactions
-        pending_transactions = TransactionPool.get_transactions()
-        for transaction in pending_transactions:
-            if transaction.type != REWARD and transaction.input[0] == self.owner.public_key:
-                outgoing += transaction.input[1]
-
-        # Check processed transactions
-        for block in Ledger.get_blocks():
-            if block.status == block_status.get("VERIFIED"):
-                for transaction in block.data: # processed transactions list
-                    receiver_public_key = transaction.output[0]
-                    if receiver_public_key == self.owner.public_key:
-                        incoming += transaction.output[1]
-                    elif transaction.type != REWARD and transaction.input[0] == self.owner.public_key:
-                        outgoing += transaction.input[1]
-
-        return incoming - outgoing
+        return balance_index.get_balance(self.owner.public_key)